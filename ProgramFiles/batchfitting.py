@@ -0,0 +1,223 @@
+'''
+batchfitting.py
+Fits many data files against many models using a pool of worker processes.
+'''
+
+# Imports #
+
+import io
+import os
+import csv
+import json
+import contextlib
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+from modelfitting import *
+
+# Number of datasets sent to a worker at a time
+CHUNK_SIZE = 16
+
+# Main Interface #
+
+# Fits every dataset in the data files against every model and returns one summary row per fit
+# settings: the program settings (see config.py). dataFiles: paths to data files. Files ending in .jsonl or 
+# .ndjson hold one dataset per record and are read lazily (see iterDataRecords). 
+# modelNumbers: indexes into MODEL_LIST. workers: number of worker processes (0 uses every CPU).
+# graphs: draw a graph for each fit. Graphs are drawn by the worker that made the fit, so a batch never uses 
+# more than workers processes. 
+# If general_settings profile is enabled, the profile of every worker is added to this process's profiler. 
+def runBatch(settings, dataFiles, modelNumbers, workers = 0, graphs = False):
+
+	workers = getWorkerCount(workers)
+	dataFiles = [str(f) for f in dataFiles]
+	profile = settings["general_settings"]["profile"]
+
+	# Jobs are made as they are needed, so datasets are only read shortly before they are fit. 
+	# Hand out several datasets at a time so that process communication does not dominate small fits. 
+	jobs = ((profileJob, profile, chunkJob, settings, chunk, modelNumbers, graphs) 
+		for chunk in groupDatasets(iterDatasets(dataFiles), CHUNK_SIZE))
+
+	rows = []
+	with ProcessPoolExecutor(max_workers = workers) as pool:
+		for results, report in mapBounded(pool, jobs, 2 * workers):
+			# Add the worker's profile (see profiling.py) to this process's profile 
+			if report is not None: 
+				profiler.merge(report)
+			rows.extend(results)
+
+	# Put rows in order (by dataset, then model)
+	modelOrder = {MODEL_LIST[m].__name__: i for i, m in enumerate(modelNumbers)}
+	rows.sort(key = lambda row: (row["dataset"], modelOrder[row["model"]]))
+	return rows
+
+# Runs a job (function and arguments) inside a worker process and returns its results and, if profile is True, 
+# the profile of the job (see profiling.py) 
+def profileJob(profile, function, *arguments):
+	profiler.reset()
+	profiler.enable(profile)
+	results = function(*arguments)
+	return results, profiler.report() if profile else None
+
+# Fits a chunk of datasets against every model. Runs inside a worker process. 
+# Returns a list of summary rows (see fitJob). 
+def chunkJob(settings, datasets, modelNumbers, graphs = False):
+	return [fitJob(settings, dataset, m, graphs) for dataset in datasets for m in modelNumbers]
+
+# Fits one dataset against one model. 
+# dataset: (number, data file name, subject, source), see iterDatasets. 
+# The fit is solved without building its text report (see solveModel). Output is captured so that workers do not 
+# write over each other.
+# If graphs is True, the graph of the fit is drawn and saved to the UserResults folder. 
+# Returns the summary row. 
+def fitJob(settings, dataset, modelNumber, graphs = False):
+
+	# Jobs already run in parallel, so each job fits with a single process
+	jobSettings = settings.override({"data_settings": {"model_number": modelNumber}, "general_settings": {"workers": 1}})
+	modelName = MODEL_LIST[modelNumber].__name__
+
+	row = makeSummaryRow(dataset, modelName)
+
+	log = io.StringIO()
+	with contextlib.redirect_stdout(log):
+		try:
+			data = loadDataset(dataset)
+			problem, optimalParams, result = solveModel(jobSettings, data)
+		except (Exception, SystemExit) as e:
+			row["status"] = getErrorStatus(e, log)
+			return row
+
+	# Get RMSD of the optimal parameters
+	flatParams, paramIndex = flattenParameters(*optimalParams)
+	rmsd = getRMSD(problem.residuals(np.array(flatParams, dtype=float)))
+	fillSummaryRow(row, problem, optimalParams, rmsd)
+
+	if graphs:
+		drawBatchGraph(jobSettings, data, optimalParams, row)
+	return row
+
+
+# Datasets #
+
+# Yields (number, data file name, subject, source) for each dataset in the data files. 
+# source is the path of a single dataset file (read by the worker), or the checked data of a record in a 
+# multi-dataset file or binary dataset folder (or a DataError if the record is not valid). 
+# subject is "" for single dataset files. 
+def iterDatasets(dataFiles):
+	number = 0
+	for dataFile in dataFiles:
+		name = os.path.basename(dataFile)
+		suffix = os.path.splitext(dataFile)[1]
+		if suffix in STREAM_SUFFIXES or suffix == BINARY_SUFFIX:
+			records = iterDataRecords(dataFile) if suffix in STREAM_SUFFIXES else iterBinaryRecords(dataFile)
+			try:
+				for subject, data, error in records:
+					yield number, name, subject, data if error is None else DataError(error)
+					number += 1
+			except (OSError, ValueError, KeyError) as e:
+				# The file could not be opened (or its header read), so report it as one failed dataset
+				yield number, name, "", DataError("cannot read " + name + " (" + type(e).__name__ + " " + str(e) + ")")
+				number += 1
+		else:
+			yield number, name, "", dataFile
+			number += 1
+
+# Returns the data of a dataset (see iterDatasets)
+def loadDataset(dataset):
+	source = dataset[3]
+	if isinstance(source, DataError):
+		raise source
+	if isinstance(source, str):
+		return getDataFromFile(source)
+	return source
+
+# Splits datasets into lists of up to size datasets (lazily)
+def groupDatasets(datasets, size):
+	group = []
+	for dataset in datasets:
+		group.append(dataset)
+		if len(group) == size:
+			yield group
+			group = []
+	if len(group) > 0:
+		yield group
+
+# Runs jobs ((function, *arguments) tuples) in a pool and yields their results in order. 
+# At most limit jobs are queued at a time, so jobs (and the datasets they hold) are only made when needed. 
+def mapBounded(pool, jobs, limit):
+	pending = collections.deque()
+	for job in jobs:
+		pending.append(pool.submit(*job))
+		if len(pending) >= limit:
+			yield pending.popleft().result()
+	while len(pending) > 0:
+		yield pending.popleft().result()
+
+
+
+# Job Results #
+
+# Describes why a job failed. Uses the last message printed by the program (such as a data file error) 
+# if the program exited, otherwise the exception. 
+def getErrorStatus(error, log):
+	messages = [line.strip() for line in log.getvalue().splitlines() if line.strip() != ""]
+	if isinstance(error, DataError):
+		return "error: " + str(error).replace("Error: ", "", 1)
+	if isinstance(error, SystemExit) and len(messages) > 0:
+		return "error: " + messages[-1].replace("Error: ", "", 1)
+	return "error: " + type(error).__name__ + " " + str(error)
+
+# Makes an empty summary row for a dataset (see iterDatasets) and model. 
+# The dataset number is only used to sort rows and is not written to the summary file. 
+def makeSummaryRow(dataset, modelName):
+	return {"dataset": dataset[0], "data_file": dataset[1], "subject": dataset[2], "model": modelName, "status": "ok",
+		"rmsd": "", "parameters": "", "graph_file": ""}
+
+# Draws the graph of a fit in a batch and stores the graph's file name in its summary row. 
+# If the graph cannot be drawn, the row's status says why and its graph file is left blank. 
+def drawBatchGraph(settings, data, optimalParams, row):
+	name = os.path.splitext(row["data_file"])[0]
+	if row["subject"] != "":
+		name += "_" + row["subject"].replace("/", "_").replace("\\", "_")
+	fileName = "Graph_" + row["model"] + "_" + name + ".png"
+	try:
+		renderGraph(settings, makeFitGraphJob(settings, data, optimalParams), resultsFolder / fileName)
+	except Exception as e:
+		row["status"] = "graph error: " + type(e).__name__ + " " + str(e)
+		return
+	row["graph_file"] = fileName
+
+# Stores the RMSD and parameters (by name) of a fit in a summary row
+def fillSummaryRow(row, problem, optimalParams, rmsd):
+	row["rmsd"] = rmsd
+	row["parameters"] = json.dumps(getParameterValues(problem, optimalParams))
+
+# Writes summary rows to a CSV file
+def writeSummary(rows, filepath):
+	columns = ["data_file", "subject", "model", "status", "rmsd", "parameters", "graph_file"]
+	with open(filepath, "w", newline = "") as f:
+		writer = csv.DictWriter(f, fieldnames = columns, extrasaction = "ignore")
+		writer.writeheader()
+		for row in rows:
+			writer.writerow(row)
+
+
+# Helper Functions #
+
+# Returns the data files matched by a directory name or glob pattern (relative to the data folder)
+def findDataFiles(pattern):
+	path = dataFolder / pattern
+	if path.is_dir() and path.suffix != BINARY_SUFFIX:
+		return sorted(f for f in path.iterdir() if f.suffix in [".json", BINARY_SUFFIX] + STREAM_SUFFIXES)
+	return sorted(dataFolder.glob(pattern))
+
+# Processes a comma separated list of model numbers. Returns every model if the list is empty.
+def parseModelNumbers(text = ""):
+	if text is None or text.strip() == "":
+		return list(range(len(MODEL_LIST)))
+	numbers = []
+	for n in text.split(","):
+		num = int(n)
+		assert(0 <= num < len(MODEL_LIST))
+		numbers.append(num)
+	return numbers
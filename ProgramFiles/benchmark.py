@@ -0,0 +1,227 @@
+'''
+benchmark.py
+Times the parts of model fitting on synthetic data, so that changes to models.py or modelfitting.py can be checked
+for speed. Run from the ProgramFiles directory:
+
+	python3 benchmark.py [--models 1,2] [--levels 3,5,10,25,50] [--subjects 5] [--output results.json]
+	python3 benchmark.py --save-baseline benchmark_baseline.json
+	python3 benchmark.py --compare benchmark_baseline.json [--tolerance 0.25]
+
+For each model and number of levels (levels x levels designs), it times model evaluation, getResiduals, a fit
+without any report (fit, see solveModel), the same fit with the logit reparameterization (fit_logit, see fit_settings
+reparameterize), a full fitModel with its text report (report: the fit plus the fit trace and result tables), drawing
+the result table and rendering the graph. Each time is the time per call (in seconds) in the fastest of
+several rounds. Fit times and the solver's function evaluations are averaged over several synthetic subjects. --compare flags every time that
+is slower than the baseline by more than the tolerance (0.25 = 25%) and exits with status 1 if any are found.
+'''
+
+# Imports #
+
+import io
+import sys
+import json
+import time
+import timeit
+import argparse
+import platform
+import numpy as np
+
+from modelfitting import *
+from config import Settings
+
+# Globals #
+
+BENCHMARKS = ["model", "residuals", "fit", "fit_logit", "report", "table", "graph"]
+
+# Synthetic Data #
+
+# Makes a synthetic dataset (in the format returned by getDataFromFile) for a two factor model.
+# Each factor has levels values drawn from (0.05, 0.95). Other parameters (such as bias) are single values.
+# The observed values are the model's prediction plus Gaussian noise (standard deviation noise), clipped to [0,1].
+def makeSyntheticData(model, levels, noise = 0.02, rng = None):
+
+	if rng is None:
+		rng = np.random.default_rng()
+	names = [p.name for p in inspect.signature(model).parameters.values()]
+
+	# True parameter values (the first two parameters are the factors)
+	params = []
+	for i, name in enumerate(names):
+		if i < 2:
+			params.append(list(np.sort(rng.uniform(0.05, 0.95, levels))))
+		else:
+			params.append(float(rng.uniform(0.05, 0.95)))
+
+	# Observed values: true values plus noise
+	prediction = evaluateModel(model, params)
+	def observe(values):
+		noisy = np.asarray(values, dtype=float) + rng.normal(0, noise, np.shape(values))
+		return [float(v) for v in np.atleast_1d(np.clip(noisy, 0, 1))]
+
+	data = [["composite", "Composite", "C", observe(prediction)]]
+	for i, (name, values) in enumerate(zip(names, params)):
+		data.append([name, name, "P" + str(i + 1), observe(values)])
+	return data
+
+# Makes settings for fitting a model without reading any settings files
+def makeBenchmarkSettings(modelNumber, reparameterize = False):
+	return Settings({"data_settings": {"model_number": modelNumber}, "general_settings": {"cache": False, "workers": 1},
+		"fit_settings": {"reparameterize": reparameterize}})
+
+
+# Benchmarks #
+
+# Returns the time per call of function (in seconds) in the fastest of repeats rounds. Each round repeats the call 
+# for at least minTime seconds. The fastest round is the least affected by other programs running at the same time.
+def timeCall(function, repeats = 5, minTime = 0.05):
+	timer = timeit.Timer(function)
+	number = 1
+	while True:
+		elapsed = timer.timeit(number)
+		if elapsed >= minTime:
+			break
+		number *= 2 if elapsed == 0 else max(2, int(minTime / elapsed) + 1)
+	# The calibration rounds above also warm up caches, so they are not counted
+	return min(timer.timeit(number) / number for i in range(repeats))
+
+# Times every benchmark for one model and design size. Returns a dictionary of benchmark name to seconds per call
+# and a dictionary of fit benchmark name to the mean number of function evaluations per fit.
+def runBenchmarks(modelNumber, levels, subjects = 5, seed = 0, benchmarks = BENCHMARKS):
+
+	model = MODEL_LIST[modelNumber]
+	settings = makeBenchmarkSettings(modelNumber)
+	rng = np.random.default_rng(seed)
+	dataSets = [makeSyntheticData(model, levels, rng = rng) for i in range(subjects)]
+	data = dataSets[0]
+
+	problem = FitProblem(settings, data)
+	params = problem.unflatten(problem.initialParams)
+	trace = FitTrace(problem.numParams)
+	optimalParams = solveModel(settings, data)[1]
+	times = {}
+	evaluations = {}
+
+	if "model" in benchmarks:
+		times["model"] = timeCall(lambda: evaluateModel(model, params))
+
+	if "residuals" in benchmarks:
+		times["residuals"] = timeCall(lambda: getResiduals(problem.initialParams, problem, trace))
+
+	# Both fits use the same synthetic subjects, so their times and evaluations can be compared directly
+	for name, reparameterize in [("fit", False), ("fit_logit", True)]:
+		if name in benchmarks:
+			fitSettings = makeBenchmarkSettings(modelNumber, reparameterize)
+			def fitAll():
+				for d in dataSets:
+					solveModel(fitSettings, d)
+			times[name] = timeCall(fitAll, repeats = 3) / subjects
+			evaluations[name] = float(np.mean([countEvaluations(fitSettings, d) for d in dataSets]))
+
+	# The same fits with the text report, so the cost of building the report is the difference from fit
+	if "report" in benchmarks:
+		def reportAll():
+			for d in dataSets:
+				fitModel(settings, d, ResultWriter(wantsText = True))
+		times["report"] = timeCall(reportAll, repeats = 3) / subjects
+
+	if "table" in benchmarks:
+		parameterData = [list(p) for p in problem.parameterData]
+		prediction = evaluateModel(model, optimalParams)
+		def drawTable():
+			table = [p[:3] + [optimal] for p, optimal in zip(parameterData, optimalParams)]
+			drawTable2Factor(table, prediction, problem.rounding, ResultWriter())
+		times["table"] = timeCall(drawTable, repeats = 3)
+
+	if "graph" in benchmarks:
+		job = makeFitGraphJob(settings, data, optimalParams)
+		times["graph"] = timeCall(lambda: renderGraph2Factor(job, io.BytesIO()), repeats = 3, minTime = 0)
+
+	return times, evaluations
+
+# Returns the number of function evaluations the solver needs to fit data
+def countEvaluations(settings, data):
+	problem, optimalParams, result = solveModel(settings, data)
+	return int(result.nfev)
+
+# Runs the benchmarks for every model and design size. Returns the results as a dictionary (see --output).
+def runSuite(modelNumbers, levelCounts, subjects = 5, seed = 0, benchmarks = BENCHMARKS, log = print):
+	results = {}
+	evaluations = {}
+	for m in modelNumbers:
+		for levels in levelCounts:
+			key = MODEL_LIST[m].__name__ + " " + str(levels) + "x" + str(levels)
+			results[key], evaluations[key] = runBenchmarks(m, levels, subjects, seed, benchmarks)
+			log(key.ljust(20), "  ".join(name + " " + formatTime(t) + (" (" + str(round(evaluations[key][name], 1)) + " evals)" 
+				if name in evaluations[key] else "") for name, t in results[key].items()))
+	return {"machine": getMachineInfo(), "subjects": subjects, "seed": seed, "results": results, "evaluations": evaluations}
+
+# Compares results against a baseline. Returns a list of (case, benchmark, baseline time, new time) for every
+# time that is slower than the baseline by more than tolerance (a fraction).
+def findRegressions(results, baseline, tolerance = 0.25):
+	regressions = []
+	for case, times in results["results"].items():
+		for name, seconds in times.items():
+			before = baseline["results"].get(case, {}).get(name)
+			if before is not None and seconds > before * (1 + tolerance):
+				regressions.append((case, name, before, seconds))
+	return regressions
+
+
+# Helper Functions #
+
+# Formats a time in seconds with a readable unit
+def formatTime(seconds):
+	if seconds < 1e-3:
+		return str(round(seconds * 1e6, 1)) + " us"
+	if seconds < 1:
+		return str(round(seconds * 1e3, 2)) + " ms"
+	return str(round(seconds, 3)) + " s"
+
+# Describes the machine and library versions, stored with results so that baselines are compared like for like
+def getMachineInfo():
+	import scipy
+	return {"python": platform.python_version(), "numpy": np.__version__, "scipy": scipy.__version__,
+		"platform": platform.platform(), "processor": platform.processor(), "date": time.strftime("%Y-%m-%d")}
+
+# Processes a comma separated list of integers
+def parseIntegers(text):
+	return [int(n) for n in text.split(",") if n.strip() != ""]
+
+
+# RUN MAIN #
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Time model fitting on synthetic data.")
+	parser.add_argument("--models", default = "1,2", help = "comma separated model numbers (default 1,2)")
+	parser.add_argument("--levels", default = "3,5,10,25,50", help = "comma separated levels per factor (default 3,5,10,25,50)")
+	parser.add_argument("--subjects", type = int, default = 5, help = "synthetic subjects fit per design (default 5)")
+	parser.add_argument("--benchmarks", default = ",".join(BENCHMARKS), help = "comma separated benchmarks to run (default all)")
+	parser.add_argument("--seed", type = int, default = 0, help = "random seed of the synthetic data (default 0)")
+	parser.add_argument("--output", help = "save the results to this JSON file")
+	parser.add_argument("--save-baseline", help = "save the results as a baseline JSON file")
+	parser.add_argument("--compare", help = "compare the results against a baseline JSON file")
+	parser.add_argument("--tolerance", type = float, default = 0.25, help = "allowed slowdown against the baseline (default 0.25)")
+	args = parser.parse_args()
+
+	benchmarks = [b.strip() for b in args.benchmarks.split(",")]
+	if any(b not in BENCHMARKS for b in benchmarks):
+		print("Error: benchmarks must be from", ", ".join(BENCHMARKS))
+		sys.exit(1)
+
+	results = runSuite(parseIntegers(args.models), parseIntegers(args.levels), args.subjects, args.seed, benchmarks)
+
+	for path in [args.output, args.save_baseline]:
+		if path:
+			with open(path, "w") as f:
+				json.dump(results, f, indent = 1)
+
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)
+		regressions = findRegressions(results, baseline, args.tolerance)
+		for case, name, before, after in regressions:
+			print("SLOWER:", case, name, formatTime(before), "->", formatTime(after))
+		if len(regressions) > 0:
+			sys.exit(1)
+		print("No benchmark is more than", str(round(args.tolerance * 100)) + "% slower than the baseline.")
+	sys.exit(0)
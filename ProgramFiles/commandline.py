@@ -7,92 +7,177 @@ Command line interface for model fitting.
 
 import sys
 import os
-import configparser
+import argparse
 import inspect 
 from pathlib import Path
 
 from models import * 
 from modelfitting import * 
 from fileparser import * 
+from batchfitting import * 
+from resampling import * 
+from comparison import * 
+from crossvalidation import * 
+from landscape import * 
+from likelihoodprofile import * 
+from config import * 
 
 # Main Interface #
 
-# Main function. Runs CLI or gets input from settings.ini
-def runAll(): 
+# Entry point. Reads command line options and settings, then runs the program. 
+def main(argv = None): 
+	parser = argparse.ArgumentParser(description = "Model fitting. Settings are read from settings.ini (see README).")
+	parser.add_argument("--no-graph", action = "store_true", help = "do not draw the graph (skips loading matplotlib)")
+	parser.add_argument("--set", action = "append", default = [], metavar = "OPTION=VALUE", 
+		help = "override a setting from settings.ini for this run (can be repeated)")
+	args = parser.parse_args(argv)
 
-	# Open user settings file 
-	userSettings = configparser.ConfigParser()
-	userSettings.read_file(open(userSettingsFile))
-
-	# Get interactive if possible
-	try: 
-		interactive = userSettings.getboolean('general_settings','interactive')
-	except: 
-		print("Error: The interactive setting (in settings.ini) requires a boolean input. Write True or False.")
-
-	# Get model if possible
+	# Resolve settings once (defaults, settings files, environment and --set). No settings file is written. 
 	try: 
-		model = userSettings.getint('data_settings','model_number')
-	except: 
-		model = -1
+		settings = loadSettings(userSettingsFile, defaultSettingsFile, os.environ, args.set)
+	except SettingsError as e: 
+		print("Error:", e)
+		return 1 
 
-	# Open user settings file 
-	userSettings = configparser.ConfigParser()
-	userSettings.read_file(open(userSettingsFile))
+	return runAll(settings, drawGraph = not args.no_graph)
 
-	# Set and fill in default settings
-	setAllDefaults(defaultSettingsFile, model) 
-	fillInDefaults(userSettingsFile, defaultSettingsFile)
+# Main function. Runs CLI or uses the settings from settings.ini 
+def runAll(settings, drawGraph = True): 
 
-	# Run program (interactive or non-interactive)
-	if interactive: 
+	# Run program (interactive, batch or non-interactive)
+	if settings["general_settings"]["interactive"]: 
 		print("\nRunning in interactive mode. See README for instructions.\n")
-		runCLI(userSettingsFile)
+		return runCLI(settings, drawGraph)
+	elif settings["batch_settings"]["batch_data"] != "": 
+		print("\nRunning in batch mode. See README for more information.\n")
+		return runBatchMode(settings)
+	elif settings["compare_settings"]["compare"]: 
+		print("\nRunning in compare mode. See README for more information.\n")
+		return runCompareMode(settings)
 	else: 
 		print("\nRunning in automatic mode. See README for more information.\n")
-		runAutomatic(userSettingsFile)
+		return runAutomatic(settings, drawGraph)
 
 # This runs modelFitting automatically based on the information provided in settings.ini 
 # This is not interactive, so it is faster to run the program multiple times. 
-def runAutomatic(settingsFile):
-
-	# Get settings 
-	settings = configparser.ConfigParser()
-	settings.read_file(open(settingsFile))
+def runAutomatic(settings, drawGraph = True):
 
 	# Get data from data file
-	dataFileName = settings["data_settings"]["data_filename"].strip('\"')
+	dataFileName = settings["data_settings"]["data_filename"]
+	if dataFileName == "": 
+		print("Error: You must provide a data file. See the README file for instructions.")
+		return 1 
 	dataFilePath = dataFolder / dataFileName
+	startProfiling(settings)
 	userData = getDataFromFile(dataFilePath) 
 
 	# Get output file 
-	outputFileName = settings["data_settings"]["result_filename"].strip('\"')
+	outputFileName = settings["data_settings"]["result_filename"]
 	outputFilePath = resultsFolder / outputFileName
 
-	# Set output to file 
-	with outputFilePath.open("w") as outputFilePath:
-		sys.stdout = outputFilePath
-	
-		# Call model fitting main function 
-		runModelFitting(settings, userData)
+	# Get result formats 
+	formats = parseResultFormats(settings["general_settings"]["result_format"])
+	if formats is None: 
+		print("Error: result_format (in settings.ini) must be a comma separated list of text, jsonl and csv.")
+		return 1 
 
-		# Reset output to stdout 
-		sys.stdout = sys.__stdout__
+	# Call model fitting main function. The result is written to the result file(s) when the block ends. 
+	with makeResultWriter(formats, outputFilePath) as writer: 
+		writer.set(data_file = dataFileName)
+		runFitting(settings, userData, drawGraph, writer)
+		reportProfiling(settings, writer)
 
 	print("\nModel Fitting Complete. See UserResults.")
 	return 0 
 
 
-# This is an interactive command line 
-# It prompts the user for necessary information and stores it in settings.ini
-def runCLI(settingsFile):
+# This fits every data file matched by batch_data against every model in batch_models (settings.ini)
+# Fits run in parallel and the results are collected into a single summary file. 
+def runBatchMode(settings):
+
+	batchSettings = settings["batch_settings"]
+
+	# Get data files 
+	dataFiles = findDataFiles(batchSettings["batch_data"])
+	if len(dataFiles) == 0: 
+		print("Error: No data files match", batchSettings["batch_data"], "in the UserData folder.")
+		return 1 
+
+	# Get models 
+	try: 
+		modelNumbers = parseModelNumbers(batchSettings["batch_models"])
+	except: 
+		print("Error: batch_models must be a comma separated list of model numbers from MODEL_LIST.")
+		return 1 
+
+	print("Fitting", len(dataFiles), "data files against", len(modelNumbers), "models.")
+	startProfiling(settings)
+	rows = runBatch(settings, dataFiles, modelNumbers, settings["general_settings"]["workers"], batchSettings["graphs"])
+	reportProfiling(settings)
+
+	# Write summary 
+	summaryFilePath = resultsFolder / batchSettings["summary_filename"]
+	writeSummary(rows, summaryFilePath)
+
+	failed = [r for r in rows if r["status"] != "ok"]
+	if len(failed) > 0: 
+		print(len(failed), "fits failed. See the status column of the summary file.")
+
+	print("\nModel Fitting Complete. See UserResults.")
+	return 0 
+
+
+# This fits every model in compare_models (settings.ini) to the data file and ranks the models 
+# The data file is read once and the models are fit in parallel. 
+def runCompareMode(settings): 
+
+	# Get data from data file
+	dataFileName = settings["data_settings"]["data_filename"]
+	if dataFileName == "": 
+		print("Error: You must provide a data file. See the README file for instructions.")
+		return 1 
+
+	# Get models 
+	try: 
+		modelNumbers = parseModelNumbers(settings["compare_settings"]["compare_models"])
+	except: 
+		print("Error: compare_models must be a comma separated list of model numbers from MODEL_LIST.")
+		return 1 
+
+	# Get result formats 
+	formats = parseResultFormats(settings["general_settings"]["result_format"])
+	if formats is None: 
+		print("Error: result_format (in settings.ini) must be a comma separated list of text, jsonl and csv.")
+		return 1 
+
+	# Check the cross-validation setting before any model is fit 
+	try: 
+		parseCrossValidation(settings["fit_settings"]["cross_validation"])
+	except ValueError as e: 
+		print("Error:", e)
+		return 1 
+
+	startProfiling(settings)
+	userData = getDataFromFile(dataFolder / dataFileName)
+
+	# Compare models. The table is written to the comparison file(s) when the block ends. 
+	outputFilePath = resultsFolder / settings["compare_settings"]["comparison_filename"]
+	print("Comparing", len(modelNumbers), "models.")
+	with makeResultWriter(formats, outputFilePath) as writer: 
+		writer.set(data_file = dataFileName)
+		runComparison(settings, userData, modelNumbers, writer)
+		reportProfiling(settings, writer)
+
+	print("\nModel Comparison Complete. See UserResults.")
+	return 0 
 
-	# Get settings 
-	settings = configparser.ConfigParser()
-	settings.read_file(open(settingsFile))
 
-	# Get settings for easy access 
-	verbose = settings["general_settings"]["verbose"]
+# This is an interactive command line 
+# It prompts the user for necessary information. Answers are used for this run only (settings.ini is not changed). 
+def runCLI(settings, drawGraph = True):
+
+	# Answers that replace settings, by section 
+	overrides = {"data_settings": {}, "graph_settings": {}, "general_settings": {}}
 	
 	# MODEL NUMBER # 
 	print("The following models are supported:")
@@ -107,9 +192,9 @@ def runCLI(settingsFile):
 		if processNumberChoice(modelNumber, MODEL_LIST) is not None:
 			break 
 
-	# Show model choice and write to settings 
+	# Show model choice. Default file names include the model name, so use the model right away. 
 	model = MODEL_LIST[int(modelNumber)]
-	settings['data_settings']['model_number'] = str(modelNumber)
+	settings = settings.override({"data_settings": {"model_number": int(modelNumber)}})
 	print("MODEL: ", model.__name__)
 	
 	# DATA FILE #  
@@ -132,8 +217,9 @@ def runCLI(settingsFile):
 		if dataFilePath.exists():
 			break 
 
-	# Get data from file and write filename to settings 
-	settings['data_settings']['data_filename'] = str(dataFileName)
+	# Get data from file 
+	overrides['data_settings']['data_filename'] = str(dataFileName)
+	startProfiling(settings)
 	userData = getDataFromFile(dataFilePath)
 
 
@@ -147,8 +233,7 @@ def runCLI(settingsFile):
 		outputFile = settings['data_settings']['result_filename']
 	outputFilePath = resultsFolder / outputFile
 
-	# Write new non-default to settings if necessary 
-	settings['data_settings']['result_filename'] = str(outputFile)
+	overrides['data_settings']['result_filename'] = str(outputFile)
 
 	# GRAPH FILE # 
 	print("\nSpecify a graph file name. If left blank, the default will be used. \nNote: If this file does not "
@@ -160,8 +245,7 @@ def runCLI(settingsFile):
 		graphFile = settings['graph_settings']['graph_filename']
 	graphFilePath = resultsFolder / graphFile
 
-	# Write new non-default to settings if necessary 
-	settings['graph_settings']['graph_filename'] = str(graphFile)
+	overrides['graph_settings']['graph_filename'] = str(graphFile)
 
 
 	# GRAPH DETAILS # 
@@ -171,61 +255,104 @@ def runCLI(settingsFile):
 		# GRAPH CAPTION #
 
 		graphCaption = input("Write the caption for your graph.\n")
-		settings['graph_settings']['graph_caption'] = str(graphCaption)
+		overrides['graph_settings']['graph_caption'] = str(graphCaption)
 
 		# GRAPH X LABEL # 
 
 		graphXLabel = input("Write the x axis label for your graph.\n")
-		settings['graph_settings']['graph_x_label'] = str(graphXLabel)
+		overrides['graph_settings']['graph_x_label'] = str(graphXLabel)
 
 		# GRAPH Y LABEL # 
 
 		graphYLabel = input("Write the y axis label for your graph.\n")
-		settings['graph_settings']['graph_y_label'] = str(graphYLabel)
+		overrides['graph_settings']['graph_y_label'] = str(graphYLabel)
 
 		# GRAPH LEGEND LABEL # 
 
 		graphLegendLabel = input("Write a legend label for your graph.\n")
-		settings['graph_settings']['graph_legend_label'] = str(graphLegendLabel)
+		overrides['graph_settings']['graph_legend_label'] = str(graphLegendLabel)
 
 	# VERBOSE OPTION # 
 	isVerbose = input("\nVerbose output? ")
 	if processTrueFalse(isVerbose):
-		verbose = True 
-
-	# Write verbose to settings
-	settings['general_settings']['verbose'] = str(verbose)
+		overrides['general_settings']['verbose'] = True 
 
 	# ROUNDING OPTION # 
 	rounding = input("\nBy default results are rounded to five (5) significant digits. To change this, enter an integer: ")
 	if processInteger(rounding) is not None:
-		rounding = str(rounding)
-		settings['general_settings']['rounding'] = str(rounding)
+		overrides['general_settings']['rounding'] = processInteger(rounding)
 
-	# Save all settings changes
-	with open(userSettingsFile, 'w') as configfile:
-		settings.write(configfile)
+	settings = settings.override(overrides)
 
 	# Run Main ModelFitting #
 
-	# Set output to file and run model fitting 
-	with outputFilePath.open("w") as outputFilePath:
-		sys.stdout = outputFilePath
-	
-		# Call model fitting main function 
-		settingsDictionary = getSettings(userSettingsFile)
+	# Get result formats 
+	formats = parseResultFormats(settings["general_settings"]["result_format"])
+	if formats is None: 
+		print("Error: result_format (in settings.ini) must be a comma separated list of text, jsonl and csv.")
+		return 1 
+
+	# Run model fitting. The result is written to the result file(s) when the block ends. 
+	with makeResultWriter(formats, outputFilePath) as writer: 
+		writer.set(data_file = str(dataFileName))
 		try: 
-			runModelFitting(settingsDictionary, userData)
-		except: 
-			print("Something went wrong. Ensure that settings.ini and models.py have been modified as needed. " 
+			runFitting(settings, userData, drawGraph, writer)
+		except Exception as e: 
+			writer.set(status = "error: " + str(e))
+			writer.write("Something went wrong. Ensure that settings.ini and models.py have been modified as needed. " 
 				"Also check that the data file is located in UserData and contains well-formatted data. See README for instructions.")
-
-		# Reset output to stdout 
-		sys.stdout = sys.__stdout__
+		reportProfiling(settings, writer)
 
 	print("\nModel Fitting Complete. See UserResults.")
 	return 0 
 
+# Fits the model and runs any extra analyses that are enabled in settings.ini 
+# writer (optional): the ResultWriter that results are reported to. By default results are printed. 
+def runFitting(settings, userData, drawGraph = True, writer = None): 
+
+	result = runModelFitting(settings, userData, drawGraph, writer)
+
+	# Bootstrap confidence intervals 
+	if settings["fit_settings"]["bootstrap"] > 0: 
+		runBootstrap(settings, userData, result, writer)
+
+	# Cross-validation 
+	if settings["fit_settings"]["cross_validation"] != "": 
+		runCrossValidation(settings, userData, result, writer)
+
+	# Profile likelihood intervals 
+	if settings["fit_settings"]["likelihood_profile"] > 0: 
+		runLikelihoodProfile(settings, userData, result, writer)
+
+	# Fit landscape (drawn next to the graph) 
+	if drawGraph and settings["graph_settings"]["landscape"] != "": 
+		runLandscape(settings, userData, result, writer)
+
+	return result 
+
+# Starts profiling the run if general_settings profile is enabled (see profiling.py) 
+def startProfiling(settings): 
+	profiler.reset()
+	profiler.enable(settings["general_settings"]["profile"])
+
+# Stops profiling and reports the profile: as a summary block in the result (or printed if there is no writer) 
+# and as JSON in the result record and in profile_filename (if set). Does nothing if profiling is not enabled. 
+def reportProfiling(settings, writer = None): 
+	if not profiler.enabled: 
+		return 
+	profiler.enable(False)
+
+	if writer is None: 
+		print("\n" + profiler.formatSummary())
+	else: 
+		writer.write(profiler.formatSummary())
+		writer.write()
+		writer.set(profile = profiler.report())
+
+	profileFileName = settings["general_settings"]["profile_filename"]
+	if profileFileName != "": 
+		profiler.save(resultsFolder / profileFileName)
+
 # HELPER FUNCTIONS #
 
 # True/False question helper function 
@@ -258,5 +385,6 @@ def processInteger(input = ""):
 
 # RUN MAIN #
 
-runAll()
+if __name__ == "__main__": 
+	sys.exit(main())
 
@@ -0,0 +1,155 @@
+'''
+comparison.py
+Compares models on the same data. The data is read once, every model is fit in parallel worker processes and the
+models are ranked by information criteria (AIC and BIC), with a likelihood-ratio test for nested models.
+'''
+
+# Imports #
+
+import io
+import math
+import contextlib
+import numpy as np
+
+from modelfitting import *
+from batchfitting import getErrorStatus
+from crossvalidation import crossValidate, makeFolds, parseCrossValidation
+
+# Main Interface #
+
+# Fits every model in modelNumbers to data and reports a table of the models ranked by AIC (best first)
+# writer (optional): the ResultWriter that the table is reported to. By default it is printed.
+# Returns the rows of the table and the likelihood-ratio tests (see compareModels).
+def runComparison(settings, data, modelNumbers, writer = None):
+
+	workers = settings["general_settings"]["workers"]
+	rounding = settings["general_settings"]["rounding"]
+
+	with useWriter(writer) as writer:
+		with writer.timer("compare"):
+			rows, tests = compareModels(settings, data, modelNumbers, workers)
+		writer.set(comparison = {"models": rows, "likelihood_ratio_tests": tests})
+		writer.write(formatComparison(rows, tests, rounding))
+
+	return rows, tests
+
+# Fits each model to the same data and scores it. Models are fit in parallel worker processes; the data is sent
+# once to each worker instead of once per model. If fit_settings cross_validation is set, each model is also
+# cross-validated (with the same folds for every model) and its row gets a CV-RMSD.
+# Returns one row per model (ranked by AIC, models that could not be fit last) and a likelihood-ratio test for
+# each pair of nested models (see nests in models.py).
+def compareModels(settings, data, modelNumbers, workers = 0):
+
+	rows = mapWorkers(fitCompareModel, (settings, data), modelNumbers, workers)
+
+	# Rank by AIC. Akaike weights give the relative support for each model.
+	fitted = [r for r in rows if r["status"] == "ok"]
+	fitted.sort(key = lambda r: r["aic"])
+	if len(fitted) > 0:
+		best = fitted[0]["aic"]
+		support = [math.exp(-(r["aic"] - best) / 2) for r in fitted]
+		for rank, (row, s) in enumerate(zip(fitted, support)):
+			row["rank"] = rank + 1
+			row["delta_aic"] = row["aic"] - best
+			row["aic_weight"] = s / sum(support)
+
+	tests = likelihoodRatioTests(fitted)
+	return fitted + [r for r in rows if r["status"] != "ok"], tests
+
+# Runs a likelihood-ratio test for each pair of fitted models where one model is nested in the other.
+# Returns a list of dictionaries with both model names, the test statistic, degrees of freedom and p value.
+def likelihoodRatioTests(rows):
+	from scipy import stats
+
+	byName = {r["model"]: r for r in rows}
+	tests = []
+	for larger in rows:
+		for model in getattr(MODEL_LIST[larger["model_number"]], "nests", []):
+			if model.__name__ not in byName:
+				continue
+			simple = byName[model.__name__]
+			df = larger["parameters"] - simple["parameters"]
+			statistic = max(0.0, simple["n"] * math.log(simple["sse"] / larger["sse"]))
+			tests.append({"simple": simple["model"], "complex": larger["model"], "statistic": statistic, "df": df,
+				"p": float(stats.chi2.sf(statistic, df)) if df > 0 else float("nan")})
+	return tests
+
+
+# Scoring #
+
+# Scores a fit on the composite data (the data every model predicts): sum of squared errors (SSE), RMSD, and
+# AIC and BIC for least squares with normally distributed errors, n log(SSE / n) plus 2k (AIC) or k log(n) (BIC),
+# where n is the number of composite values and k the number of free parameters.
+def scoreFit(problem, flatParams):
+	residuals = problem.residuals(np.asarray(flatParams, dtype=float))[problem.numParams:]
+	n = len(residuals)
+	k = problem.numParams
+	# A perfect fit would give log(0), so the SSE is kept just above 0
+	sse = max(float(np.dot(residuals, residuals)), np.finfo(float).tiny)
+	fit = n * math.log(sse / n)
+	return {"n": n, "parameters": k, "sse": sse, "rmsd": math.sqrt(sse / n), "aic": fit + 2 * k, "bic": fit + k * math.log(n)}
+
+
+# Fits one model to the shared data without printing. state: the settings and data (see mapWorkers in
+# modelfitting.py). Returns its row of the comparison table.
+def fitCompareModel(state, modelNumber):
+	settings, data = state
+
+	# Models are already fit in parallel, so each fit uses a single process
+	jobSettings = settings.override({"data_settings": {"model_number": modelNumber}, "general_settings": {"workers": 1}})
+	row = {"model": MODEL_LIST[modelNumber].__name__, "model_number": modelNumber, "status": "ok"}
+
+	log = io.StringIO()
+	with contextlib.redirect_stdout(log):
+		try:
+			problem, optimalParams, result = solveModel(jobSettings, data)
+		except (Exception, SystemExit) as e:
+			row["status"] = getErrorStatus(e, log)
+			return row
+
+	flatParams, paramIndex = flattenParameters(*optimalParams)
+	row.update(scoreFit(problem, flatParams))
+	row["solver_status"] = int(result.status)
+	row["optimal_parameters"] = getParameterValues(problem, optimalParams)
+
+	# Cross-validation (folds run one after another, since models already run in parallel)
+	method = parseCrossValidation(settings["fit_settings"]["cross_validation"])
+	if method is not None:
+		folds = makeFolds(method, row["n"], settings["fit_settings"]["seed"])
+		row["cv_rmsd"] = crossValidate(problem, np.array(flatParams, dtype=float), folds, 1)["rmsd"]
+	return row
+
+
+# Helper Functions #
+
+# Returns the comparison table (and likelihood-ratio tests) as text
+def formatComparison(rows, tests, rounding = 5):
+	import pandas as pd
+
+	lines = ["Model Comparison", ""]
+	fitted = [r for r in rows if r["status"] == "ok"]
+	if len(fitted) > 0:
+		columns = ["rank", "model", "parameters", "sse", "rmsd", "aic", "bic", "delta_aic", "aic_weight"]
+		names = ["Rank", "Model", "k", "SSE", "RMSD", "AIC", "BIC", "dAIC", "Weight"]
+		if "cv_rmsd" in fitted[0]:
+			columns.insert(5, "cv_rmsd")
+			names.insert(5, "CV-RMSD")
+		table = pd.DataFrame([[r[c] for c in columns] for r in fitted], columns = names)
+		lines.append(table.round(rounding).to_string(index = False))
+		lines.append("")
+		lines.append("Scores use the " + str(fitted[0]["n"]) + " composite values. k is the number of free parameters. "
+			"Lower AIC and BIC are better.")
+		lines.append("")
+
+	if len(tests) > 0:
+		lines.append("Likelihood-Ratio Tests (nested models)")
+		lines.append("")
+		for t in tests:
+			lines.append(t["simple"] + " vs " + t["complex"] + ": LR = " + str(round(t["statistic"], rounding)) + ", df = "
+				+ str(t["df"]) + ", p = " + str(round(t["p"], rounding)))
+		lines.append("")
+
+	for r in rows:
+		if r["status"] != "ok":
+			lines.append(r["model"] + " was not fit (" + r["status"] + ")")
+	return "\n".join(lines)
@@ -0,0 +1,285 @@
+'''
+config.py
+Resolves the program settings once, in memory, from four layers (later layers win):
+
+	1. built-in defaults (SETTINGS_SCHEMA)
+	2. default.ini and then settings.ini (blank options are skipped)
+	3. environment variables named MODELFITTING_<OPTION>, for example MODELFITTING_WORKERS=4
+	4. command line overrides (--set option=value)
+
+The result is a Settings object with typed values (True/False, numbers, text) that cannot be changed. No settings
+file is ever written, so several runs can use the same settings files at the same time.
+'''
+
+# Imports #
+
+import os
+import configparser
+from collections.abc import Mapping
+
+from models import *
+from fileparser import *
+
+# Globals #
+
+# Prefix of environment variables that override settings
+ENVIRONMENT_PREFIX = "MODELFITTING_"
+
+# Type and built-in default of every option, by section. A default of None is filled in by getComputedDefaults
+# (for result and graph file names that include the model name and date).
+SETTINGS_SCHEMA = {
+	"general_settings": {
+		"interactive": (bool, True),
+		"verbose": (bool, False),
+		"rounding": (int, 5),
+		"workers": (int, 0),
+		"trace_stride": (int, 1),
+		"trace_filename": (str, ""),
+		"cache": (bool, False),
+		"cache_size_mb": (float, 100.0),
+		"result_format": (str, "text"),
+		"profile": (bool, False),
+		"profile_filename": (str, ""),
+		"jit": (bool, False),
+	},
+	"data_settings": {
+		"data_filename": (str, ""),
+		"result_filename": (str, None),
+		"model_number": (int, 0),
+	},
+	"graph_settings": {
+		"graph_filename": (str, None),
+		"graph_caption": (str, ""),
+		"graph_x_label": (str, ""),
+		"graph_y_label": (str, ""),
+		"graph_legend_label": (str, "Legend"),
+		"landscape": (str, ""),
+		"landscape_points": (int, 51),
+	},
+	"fit_settings": {
+		"multistart": (int, 0),
+		"multistart_keep": (float, 0.5),
+		"bootstrap": (int, 0),
+		"bootstrap_method": (str, "residuals"),
+		"confidence": (float, 0.95),
+		"cross_validation": (str, ""),
+		"likelihood_profile": (int, 0),
+		"reparameterize": (bool, False),
+		"seed": (int, None),
+	},
+	"compare_settings": {
+		"compare": (bool, False),
+		"compare_models": (str, ""),
+		"comparison_filename": (str, None),
+	},
+	"batch_settings": {
+		"batch_data": (str, ""),
+		"batch_models": (str, ""),
+		"graphs": (bool, False),
+		"summary_filename": (str, None),
+	},
+}
+
+# Allowed values of options that take one of a fixed set of words (a blank value uses the default)
+OPTION_CHOICES = {
+	"bootstrap_method": ["residuals", "cells"],
+}
+
+# Section of each option (option names are unique across sections)
+OPTION_SECTIONS = {option: section for section, options in SETTINGS_SCHEMA.items() for option in options}
+
+TRUE_VALUES = ["true", "t", "yes", "y", "1"]
+FALSE_VALUES = ["false", "f", "no", "n", "0"]
+
+# Settings #
+
+# Raised when a setting is unknown or has a value of the wrong type
+class SettingsError(ValueError):
+	pass
+
+# The resolved program settings. Read values like a dictionary: settings["general_settings"]["verbose"].
+# Settings cannot be changed; override() returns new settings with some options replaced.
+class Settings(Mapping):
+
+	def __init__(self, explicit):
+		# Options given by a layer other than the built-in defaults (by section)
+		self.explicit = {section: dict(explicit.get(section, {})) for section in SETTINGS_SCHEMA}
+
+		values = {section: {option: default for option, (kind, default) in options.items()}
+			for section, options in SETTINGS_SCHEMA.items()}
+		for section, options in self.explicit.items():
+			values[section].update(options)
+
+		# Fill in defaults that depend on other settings
+		for (section, option), value in getComputedDefaults(values).items():
+			if values[section][option] in [None, ""]:
+				values[section][option] = value
+
+		self.sections = {section: SettingsSection(options) for section, options in values.items()}
+
+	def __getitem__(self, section):
+		return self.sections[section]
+
+	def __iter__(self):
+		return iter(self.sections)
+
+	def __len__(self):
+		return len(self.sections)
+
+	def __repr__(self):
+		return "Settings(" + repr({section: dict(options) for section, options in self.items()}) + ")"
+
+	# Returns new settings with options replaced. overrides: {section: {option: value}}. Values may be typed
+	# or text (text is converted like a value in settings.ini).
+	def override(self, overrides):
+		explicit = {section: dict(options) for section, options in self.explicit.items()}
+		for section, options in overrides.items():
+			for option, value in options.items():
+				value = parseValue(section, option, value, "override")
+				explicit[section][option] = value
+		return Settings(explicit)
+
+# The options of one settings section (read only)
+class SettingsSection(Mapping):
+
+	def __init__(self, options):
+		self.options = dict(options)
+
+	def __getitem__(self, option):
+		return self.options[option]
+
+	def __iter__(self):
+		return iter(self.options)
+
+	def __len__(self):
+		return len(self.options)
+
+	def __repr__(self):
+		return repr(self.options)
+
+
+# Loading Functions #
+
+# Resolves the settings from every layer. Does not write any files.
+# environment: a dictionary of environment variables (os.environ by default). overrides: a list of
+# "option=value" strings (from --set on the command line).
+# Raises SettingsError if a setting is unknown or has the wrong type.
+def loadSettings(settingsFile = userSettingsFile, defaultFile = defaultSettingsFile, environment = None, overrides = None):
+
+	if environment is None:
+		environment = os.environ
+
+	layers = [
+		(defaultFile.name, readSettingsFile(defaultFile)),
+		(settingsFile.name, readSettingsFile(settingsFile)),
+		("environment", readEnvironment(environment)),
+		("--set", parseOverrides(overrides or [])),
+	]
+
+	explicit = {section: {} for section in SETTINGS_SCHEMA}
+	for source, layer in layers:
+		for section, options in layer.items():
+			for option, text in options.items():
+				if text is None or str(text).strip() == "":
+					continue
+				explicit[section][option] = parseValue(section, option, text, source)
+
+	return Settings(explicit)
+
+# Reads an .ini settings file. Returns {section: {option: text}}. A missing file is treated as empty.
+def readSettingsFile(filepath):
+	parser = configparser.ConfigParser()
+	try:
+		with open(filepath) as f:
+			parser.read_file(f)
+	except FileNotFoundError:
+		return {}
+	except configparser.Error as e:
+		raise SettingsError("Cannot read " + str(filepath) + ". " + str(e).splitlines()[0])
+
+	layer = {}
+	for section in parser.sections():
+		if section not in SETTINGS_SCHEMA:
+			raise SettingsError("Unknown section [" + section + "] in " + str(filepath.name) + ".")
+		layer[section] = dict(parser[section])
+	return layer
+
+# Reads MODELFITTING_<OPTION> environment variables. Returns {section: {option: text}}.
+def readEnvironment(environment):
+	layer = {}
+	for name, text in environment.items():
+		if not name.startswith(ENVIRONMENT_PREFIX):
+			continue
+		option = name[len(ENVIRONMENT_PREFIX):].lower()
+		if option not in OPTION_SECTIONS:
+			raise SettingsError("Unknown setting in environment variable " + name + ".")
+		layer.setdefault(OPTION_SECTIONS[option], {})[option] = text
+	return layer
+
+# Reads "option=value" overrides. Returns {section: {option: text}}.
+def parseOverrides(overrides):
+	layer = {}
+	for override in overrides:
+		option, separator, text = override.partition("=")
+		option = option.strip().lower()
+		if separator == "" or option not in OPTION_SECTIONS:
+			raise SettingsError("Expected --set option=value with an option from settings.ini, got " + override + ".")
+		layer.setdefault(OPTION_SECTIONS[option], {})[option] = text
+	return layer
+
+# Converts a setting to its type (see SETTINGS_SCHEMA). source names where the value came from (for errors).
+def parseValue(section, option, value, source):
+
+	if section not in SETTINGS_SCHEMA or option not in SETTINGS_SCHEMA[section]:
+		raise SettingsError("Unknown setting " + option + " in " + source + ".")
+	kind, default = SETTINGS_SCHEMA[section][option]
+
+	# Typed values (from override()) only need checking
+	if not isinstance(value, str):
+		if value is None and default is None:
+			return None
+		if kind is float and isinstance(value, int) and not isinstance(value, bool):
+			return float(value)
+		if isinstance(value, kind) and (kind is bool or not isinstance(value, bool)):
+			return value
+		value = str(value)
+
+	text = value.strip().strip('\"')
+	if option in OPTION_CHOICES and text != "":
+		if text.lower() not in OPTION_CHOICES[option]:
+			raise SettingsError("The " + option + " setting (in " + source + ") must be " + 
+				" or ".join(OPTION_CHOICES[option]) + ", got " + text + ".")
+		return text.lower()
+	if kind is str:
+		return text
+	if text == "":
+		return default
+	if kind is bool:
+		if text.lower() in TRUE_VALUES:
+			return True
+		if text.lower() in FALSE_VALUES:
+			return False
+		raise SettingsError("The " + option + " setting (in " + source + ") requires a boolean input. Write True or False.")
+	try:
+		number = float(text)
+		if kind is int:
+			assert(number == int(number))
+			return int(number)
+		return number
+	except (ValueError, AssertionError, OverflowError):
+		kindName = "an integer" if kind is int else "a number"
+		raise SettingsError("The " + option + " setting (in " + source + ") requires " + kindName + ", got " + text + ".")
+
+# Returns defaults that depend on other settings: result, graph, summary and comparison file names with the model 
+# name and date
+def getComputedDefaults(values):
+	modelNumber = values["data_settings"]["model_number"]
+	if not 0 <= modelNumber < len(MODEL_LIST):
+		raise SettingsError("model_number must be a number from 0 to " + str(len(MODEL_LIST) - 1) + " (see MODEL_LIST).")
+	modelName = MODEL_LIST[modelNumber].__name__
+	return {
+		("data_settings", "result_filename"): "Result_" + modelName + "_" + today.strftime("%d-%m-%Y"),
+		("graph_settings", "graph_filename"): "Graph_" + modelName + "_" + today.strftime("%d-%m-%Y"),
+		("batch_settings", "summary_filename"): "Summary_" + today.strftime("%d-%m-%Y") + ".csv",
+		("compare_settings", "comparison_filename"): "Comparison_" + today.strftime("%d-%m-%Y"),
+	}
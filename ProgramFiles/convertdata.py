@@ -0,0 +1,135 @@
+'''
+convertdata.py
+Converts JSON data files to binary dataset folders, which load much faster when fitting many datasets in batch
+mode. Run from the ProgramFiles directory:
+
+	python3 convertdata.py subjects.jsonl [--output subjects.fitdata]
+
+The input is a data file (.json) or a file with many datasets (.jsonl or .ndjson), looked up in the UserData
+folder (or used as given if it is a path to an existing file). Every dataset must have the same sections with the
+same number of values. Datasets with errors are skipped and reported. The output folder is written to the
+UserData folder (by default the input name with the .fitdata suffix) and holds:
+
+	header.json       section names, labels and abbreviations, and the number of datasets
+	section<N>.npy    the values of section N, one row per dataset
+	subjects.npy      the subject name of each dataset
+'''
+
+# Imports #
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import numpy as np
+from pathlib import Path
+
+from fileparser import *
+
+# Conversion Functions #
+
+# Yields (subject, data, error) for each dataset in a JSON data file or a file with many datasets
+def iterJSONRecords(filepath):
+	if Path(filepath).suffix in STREAM_SUFFIXES:
+		yield from iterDataRecords(filepath)
+		return
+	with open(filepath) as f:
+		objects = json.load(f)
+	try:
+		yield Path(filepath).stem, validateObjects(objects), None
+	except DataError as e:
+		yield Path(filepath).stem, None, str(e).replace("Error: ", "", 1)
+
+# Converts a JSON data file to a binary dataset folder. Returns the number of datasets written and a list of
+# (subject, error) for datasets that were skipped.
+def convertDataFile(inputPath, outputPath):
+
+	# First pass: find the sections (from the first valid dataset) and count the datasets that match them
+	layout = None
+	count = 0
+	skipped = []
+	for subject, data, error in iterJSONRecords(inputPath):
+		if error is None:
+			if layout is None:
+				layout = [(name, label, abrv, len(values)) for name, label, abrv, values in data]
+			error = checkLayout(data, layout)
+		if error is None:
+			count += 1
+		else:
+			skipped.append((subject, error))
+
+	if layout is None:
+		raise DataError("No valid datasets found in " + str(inputPath))
+
+	# Second pass: write each section's values straight into its array on disk.
+	# Write to a temporary folder first so that a failed conversion never leaves a partial dataset.
+	temporaryPath = Path(str(outputPath) + ".tmp")
+	shutil.rmtree(temporaryPath, ignore_errors = True)
+	temporaryPath.mkdir(parents = True)
+
+	arrays = []
+	for i, (name, label, abrv, size) in enumerate(layout):
+		arrays.append(np.lib.format.open_memmap(temporaryPath / ("section" + str(i) + ".npy"), mode = "w+",
+			dtype = np.float64, shape = (count, size)))
+	subjects = []
+
+	row = 0
+	for subject, data, error in iterJSONRecords(inputPath):
+		if error is not None or checkLayout(data, layout) is not None:
+			continue
+		for array, section in zip(arrays, data):
+			array[row] = section[3]
+		subjects.append(subject)
+		row += 1
+
+	for array in arrays:
+		array.flush()
+	del arrays
+	np.save(temporaryPath / "subjects.npy", np.array(subjects, dtype = str))
+
+	header = {
+		"format": BINARY_FORMAT,
+		"subjects": count,
+		"subject_file": "subjects.npy",
+		"sections": [{"name": name, "label": label, "abbreviation": abrv, "size": size, "file": "section" + str(i) + ".npy"}
+			for i, (name, label, abrv, size) in enumerate(layout)],
+	}
+	with open(temporaryPath / BINARY_HEADER, "w") as f:
+		json.dump(header, f, indent = 1)
+
+	shutil.rmtree(outputPath, ignore_errors = True)
+	os.replace(temporaryPath, outputPath)
+	return count, skipped
+
+# Returns an error message if a dataset's sections differ from the layout, otherwise None
+def checkLayout(data, layout):
+	names = [(name, len(values)) for name, label, abrv, values in data]
+	if names != [(name, size) for name, label, abrv, size in layout]:
+		return "sections differ from the first dataset (" + ", ".join(n + " " + str(s) for n, s in names) + ")"
+	return None
+
+
+# RUN MAIN #
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Convert a JSON data file to a binary dataset folder.")
+	parser.add_argument("data_file", help = "data file (in UserData or a path)")
+	parser.add_argument("--output", help = "output folder name in UserData (default: the data file name with " + BINARY_SUFFIX + ")")
+	args = parser.parse_args()
+
+	inputPath = Path(args.data_file)
+	if not inputPath.exists():
+		inputPath = dataFolder / args.data_file
+	outputPath = dataFolder / (args.output if args.output else inputPath.stem + BINARY_SUFFIX)
+
+	try:
+		count, skipped = convertDataFile(inputPath, outputPath)
+	except (OSError, ValueError) as e:
+		print("Error:", e)
+		sys.exit(1)
+
+	for subject, error in skipped:
+		print("Skipped", subject + ":", error)
+	print("Wrote", count, "datasets to", outputPath)
+	sys.exit(0)
@@ -0,0 +1,104 @@
+'''
+crossvalidation.py
+Scores how well a model predicts data it was not fit to (cross-validation). Composite cells are held out one at
+a time (leave-one-out) or in k folds, the model is refit to the remaining data and the held-out cells are
+predicted. Every refit starts from the full-data optimum, so it only needs a few iterations.
+'''
+
+# Imports #
+
+import numpy as np
+
+from modelfitting import *
+
+# Main Interface #
+
+# Runs cross-validation for a fitted model and reports the CV-RMSD (the RMSD of the held-out predictions)
+# optimalParams: the parameters returned by fitModel
+# writer (optional): the ResultWriter that the result is reported to. By default it is printed.
+def runCrossValidation(settings, data, optimalParams, writer = None):
+
+	# Settings for easy access
+	seed = settings["fit_settings"]["seed"]
+	workers = settings["general_settings"]["workers"]
+
+	try:
+		method = parseCrossValidation(settings["fit_settings"]["cross_validation"])
+	except ValueError as e:
+		print("Error:", e)
+		return None
+	if method is None:
+		return None
+
+	problem = FitProblem(settings, data)
+	flatParams, paramIndex = flattenParameters(*optimalParams)
+	optimal = np.array(flatParams, dtype=float)
+	folds = makeFolds(method, len(problem.observed) - problem.numParams, seed)
+
+	with useWriter(writer) as writer:
+		with writer.timer("cross_validation"):
+			result = crossValidate(problem, optimal, folds, workers)
+
+		# Report the CV-RMSD next to the RMSD of the full fit (on the same composite cells)
+		rounding = problem.rounding
+		fitResiduals = problem.residuals(optimal)[problem.numParams:]
+		writer.set(cross_validation = {"method": "leave-one-out" if method == "loo" else str(len(folds)) + "-fold",
+			"folds": len(folds), "rmsd": result["rmsd"], "fit_rmsd": getRMSD(fitResiduals), "evaluations": result["evaluations"]})
+		writer.write()
+		writer.write("Cross-Validation")
+		writer.write()
+		writer.write(("Leave-one-out" if method == "loo" else str(len(folds)) + "-fold") + " cross-validation of the "
+			+ str(len(fitResiduals)) + " composite values (" + str(result["evaluations"]) + " function evaluations)")
+		writer.write("CV-RMSD", round(result["rmsd"], rounding))
+		writer.write("Fit RMSD", round(getRMSD(fitResiduals), rounding))
+
+	return result["rmsd"]
+
+# Holds out each fold of composite cells in turn, refits the problem to the rest (starting from optimal) and
+# predicts the held-out cells. Folds are refit in parallel worker processes.
+# Returns a dictionary with the CV-RMSD, the held-out residual of every composite cell, the number of folds and
+# the total number of function evaluations.
+def crossValidate(problem, optimal, folds, workers = 0):
+
+	results = mapWorkers(fitFold, (problem, optimal), folds, workers)
+
+	heldOut = np.empty(len(problem.observed) - problem.numParams)
+	evaluations = 0
+	for fold, (residuals, nfev) in zip(folds, results):
+		heldOut[fold] = residuals
+		evaluations += nfev
+
+	return {"rmsd": getRMSD(heldOut), "residuals": heldOut, "folds": len(folds), "evaluations": evaluations}
+
+# Splits the composite cells (numbered from 0) into folds. method: "loo" (one cell per fold) or a number of folds.
+# Cells are assigned to folds at random (using seed), so the same seed gives the same folds for every model.
+def makeFolds(method, numCells, seed = None):
+	if method == "loo" or method >= numCells:
+		return [np.array([i]) for i in range(numCells)]
+	rng = np.random.default_rng(None if seed is None else int(seed))
+	return [np.sort(fold) for fold in np.array_split(rng.permutation(numCells), method)]
+
+# Reads a cross_validation setting. Returns None (off), "loo" (leave-one-out) or a number of folds.
+# Raises ValueError if the setting is not valid.
+def parseCrossValidation(text):
+	text = str(text).strip().strip('\"').lower()
+	if text in ["", "0", "false", "none"]:
+		return None
+	if text in ["loo", "leave-one-out"]:
+		return "loo"
+	try:
+		folds = int(text)
+		assert(folds >= 2)
+	except (ValueError, AssertionError):
+		raise ValueError("The cross_validation setting (in settings.ini) must be loo or a number of folds (2 or more).")
+	return folds
+
+# Refits the problem without the cells in fold (their residuals get a weight of 0), starting from the full-data
+# optimum. state: the problem and its optimal parameters (see mapWorkers in modelfitting.py).
+# Returns the residuals of the held-out cells and the number of function evaluations.
+def fitFold(state, fold):
+	problem, optimal = state
+	weights = np.ones(len(problem.observed))
+	weights[problem.numParams + fold] = 0
+	result = solveProblem(problem.withObserved(problem.observed, weights), optimal)
+	return problem.residuals(result.x)[problem.numParams + fold], int(result.nfev)
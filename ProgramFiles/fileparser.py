@@ -1,20 +1,32 @@
 '''
 fileParser.py 
-Includes functions for parsing data from datafiles and parsing settings from settings.ini. 
+Includes functions for parsing data from datafiles. Settings are resolved in config.py. 
 '''
 
 # Imports #
 import sys
-import configparser
 import json
+import numpy as np
 from pathlib import Path
 from datetime import date
 
 from models import * 
+from profiling import * 
 
 # Globals # 
 today = date.today() 
 
+# Streaming data files (see iterDataRecords) 
+STREAM_SUFFIXES = [".jsonl", ".ndjson"]
+STREAM_CHUNK_SIZE = 64 * 1024
+MAX_RECORD_SIZE = 16 * 1024 * 1024
+
+# Binary dataset folders (see loadBinaryDataset and convertdata.py) 
+BINARY_SUFFIX = ".fitdata"
+BINARY_HEADER = "header.json"
+BINARY_FORMAT = 1
+BINARY_BLOCK_SIZE = 4096
+
 # Filepaths 
 global programFolder
 global dataFolder 
@@ -28,6 +40,10 @@ resultsFolder = Path("../UserResults")
 userSettingsFile = Path("../settings.ini")
 defaultSettingsFile = Path("../default.ini")
 
+# Raised when a dataset is not valid 
+class DataError(ValueError): 
+	pass
+
 # Helper Functions # 
 
 # Check if a file exists and is valid 
@@ -42,11 +58,15 @@ def foundDataFile(input = ""):
 
 # Gets data from file
 # Returns a list of lists
+@profiled
 def getDataFromFile(filename):
 
+	# Binary dataset folders hold many datasets. Only a folder with one dataset can be fit on its own. 
+	if Path(filename).suffix == BINARY_SUFFIX: 
+		return getDataFromBinaryDataset(filename)
+
 	# Get file 
 	try: 
-		formattedData = []
 		with open(filename) as f:
 			objects = json.load(f)
 	except: 
@@ -55,6 +75,26 @@ def getDataFromFile(filename):
 			"README for instructions. ")
 		sys.exit(1) 
 
+	return getDataFromObjects(objects)
+
+# Gets data from a list of sections (in the same format as a data file)
+# Returns a list of lists
+def getDataFromObjects(objects):
+	try: 
+		return validateObjects(objects)
+	except DataError as e: 
+		print(str(e) + "\n")
+		sys.exit(1)
+
+# Checks a list of sections (in the same format as a data file)
+# Returns a list of [name, label, abbreviation, data] lists. Raises DataError if a section is not valid. 
+def validateObjects(objects):
+
+	formattedData = []
+
+	if not isinstance(objects, list): 
+		raise DataError("Something went wrong. Check that your data file is formatted correctly.")
+
 	# Get objects from file 
 	for o in objects: 
 		try: 
@@ -63,23 +103,18 @@ def getDataFromFile(filename):
 			abrv = o.get("abbreviation")
 			data = o.get("data")
 		except: 
-			print("Something went wrong. Check that your data file is formatted correctly.\n")
-			sys.exit(1) 
+			raise DataError("Something went wrong. Check that your data file is formatted correctly.")
 		
 		# Check data is nonempty
-		try: 
-			assert(data != None and data != [])
-		except: 
-			print("Error: No data provided for", name, "\n")
-			sys.exit(1) 
+		if data is None or data == []: 
+			raise DataError("Error: No data provided for " + str(name))
 
 		# Check all data is between 0 and 1 
 		try: 
 			for d in data: 
 				assert(0 <= d <= 1)
 		except:
-			print("Error: All data points must be in range [0,1] inclusive. Error found in:", name, "\n") 
-			sys.exit(1) 
+			raise DataError("Error: All data points must be in range [0,1] inclusive. Error found in: " + str(name))
 
 		# Add data to result 
 		formattedData.append([name, label, abrv, data])
@@ -87,119 +122,128 @@ def getDataFromFile(filename):
 	# Return result 
 	return formattedData
 
-# Process settings.ini file 
-# Returns a dictionary of settings 
-def getSettings(filepath):
-	settings = {}
-	try: 
-		parser = configparser.ConfigParser()
-		parser.read_file(open(filepath))
-	except: 
-		print("Something went wrong. Cannot open settings.ini.")
-
-	for section in parser.sections():
-		settings[section] = {}
-		for option in parser.options(section):
-
-			if option == 'verbose' or option == 'interactive':
-				settings[section][option] = parser.getboolean(section, option)
-
-			# Check that a data file is provided 
-			try:
-				if option == 'data_filename':
-					file = parser.get('data_settings', 'data_filename')
-					assert(file != "" and file != None)  
-			except: 
-				print("Error: You must provide a data file. See the README file for instructions.")
-				sys.exit(1)
-
-			# Check that options are the right kind and that we can acess them 
+# Reads a data file that holds many datasets (one per record) without loading the whole file. 
+# Records are JSON Lines or concatenated JSON. A record is either a list of sections (like a data file) or an 
+# object {"subject": "...", "sections": [...]}. Records without a subject are numbered from 1. 
+# Yields (subject, data, error) for each record: data is the checked list of sections (see validateObjects) and 
+# error is None, or data is None and error says why the record was rejected. A record that is not valid JSON is 
+# reported and reading continues on the next line. Memory use is bounded by the largest record (MAX_RECORD_SIZE), 
+# not the file size. 
+def iterDataRecords(filepath): 
+	decoder = json.JSONDecoder()
+	with open(filepath) as f: 
+		buffer = ""
+		position = 0
+		number = 0
+		endOfFile = False
+		while True: 
+
+			# Skip whitespace between records 
+			while position < len(buffer) and buffer[position].isspace(): 
+				position += 1
+			if position == len(buffer): 
+				if endOfFile: 
+					return
+				buffer = f.read(STREAM_CHUNK_SIZE)
+				position = 0
+				endOfFile = buffer == ""
+				continue
+
+			# Decode the next record, reading more of the file if the record is not complete yet. JSON cannot 
+			# continue a string over a line break, so an error before the last line of the buffer is not caused 
+			# by a record that has not been read yet. 
 			try: 
-				if option == 'verbose':
-					v = parser.get('general_settings', 'verbose')
-					assert(v == "True" or v == "False")
-			except: 
-				print("Error: Verbose option must be either True or False.")
-
-			try:  
-				settings[section][option] = parser.get(section, option)
-			except: 
-				print("Something went wrong. Ensure that all section and option names in settings.ini have not been modified.")
-				sys.exit(1)
-	return settings
-
-# Sets all default settings
-# Returns nothing - should modify default.ini if necessary 
-def setAllDefaults(filepath, modelNumber = -1): 
-
-	try: 
-		# Get initial settings 
-		settings = configparser.ConfigParser(allow_no_value = True)
-		settings.read_file(open(filepath))
-
-		try: 
-			assert(modelNumber >= -1)
-			modelName = MODEL_LIST[int(modelNumber)].__name__
-		except: 
-			modelName = "Model" + str(modelNumber)
-
-		# Make default paths for result and graph files 
-		resultFileName = ("Result_" + modelName + "_" + today.strftime("%d-%m-%Y"))
-		graphFileName = ("Graph_" + modelName + "_" + today.strftime("%d-%m-%Y")) 
-
-		# General Settings
-		settings['general_settings']['interactive'] = "True"
-		settings['general_settings']['verbose'] = "False"
-
-		# Data Settings
-		settings['data_settings']['model_number'] = "0" 
-		settings['data_settings']['result_filename'] = str(resultFileName)
-
-		# Graph Settings 
-		settings['graph_settings']['graph_filename'] = str(graphFileName)
-		settings['graph_settings']['graph_caption'] = ""
-		settings['graph_settings']['graph_x_label'] = ""
-		settings['graph_settings']['graph_y_label'] = ""
-		settings['graph_settings']['graph_legend_label'] = "Legend"
-
-		with open(filepath, 'w') as configfile:
-			settings.write(configfile)
-	except: 
-		print("Something went wrong. Ensure that default.ini has not been modified.")
-		sys.exit(1)
-
-	return 0 
-
-# Fills in blank values with the default value.
-# Returns nothing - should modify settings.ini if necessary 
-def fillInDefaults(filepath, defaultSettingsFile): 
+				record, end = decoder.raw_decode(buffer, position)
+			except json.JSONDecodeError as e: 
+				incomplete = e.pos > buffer.rfind("\n")
+				if incomplete and not endOfFile and len(buffer) - position < MAX_RECORD_SIZE: 
+					chunk = f.read(STREAM_CHUNK_SIZE)
+					endOfFile = chunk == ""
+					buffer = buffer[position:] + chunk
+					position = 0
+					continue
+
+				# Report the record and skip to the next line (the next record in JSON Lines) 
+				number += 1
+				yield str(number), None, "record " + str(number) + " is not valid JSON (" + e.msg + ")"
+				lineEnd = buffer.find("\n", position)
+				while lineEnd == -1 and not endOfFile: 
+					buffer = f.read(STREAM_CHUNK_SIZE)
+					endOfFile = buffer == ""
+					lineEnd = buffer.find("\n")
+				position = len(buffer) if lineEnd == -1 else lineEnd + 1
+				continue
+			position = end
+			number += 1
+
+			# Check the record 
+			subject = str(number)
+			sections = record
+			if isinstance(record, dict): 
+				subject = str(record.get("subject", number))
+				sections = record.get("sections")
+			try: 
+				yield subject, validateObjects(sections), None
+			except DataError as e: 
+				yield subject, None, str(e).replace("Error: ", "", 1)
+
+# Loads a binary dataset folder. The folder holds a small JSON header (section names, labels and abbreviations)
+# and one .npy array per section with a row for each dataset. Arrays are memory mapped, so loading is fast and 
+# rows are only read from disk when they are used. 
+# Returns the header, a list of (name, label, abbreviation, array) for each section and the subject names. 
+def loadBinaryDataset(folder): 
+	folder = Path(folder)
+	with open(folder / BINARY_HEADER) as f: 
+		header = json.load(f)
+	if header.get("format") != BINARY_FORMAT: 
+		raise DataError("Unknown binary dataset format in " + str(folder))
+
+	sections = []
+	for section in header["sections"]: 
+		array = np.load(folder / section["file"], mmap_mode = "r")
+		if array.ndim != 2 or array.shape[0] != header["subjects"]: 
+			raise DataError("The data of " + section["name"] + " in " + str(folder) + " does not match the header")
+		sections.append((section["name"], section["label"], section["abbreviation"], array))
+	subjects = np.load(folder / header["subject_file"], mmap_mode = "r")
+	return header, sections, subjects
+
+# Returns a boolean array that is True for each dataset (row) whose values are all in range [0,1] 
+def findValidRows(sections): 
+	valid = np.ones(len(sections[0][3]) if len(sections) > 0 else 0, dtype = bool)
+	for name, label, abrv, array in sections: 
+		# NaN fails both comparisons, so it is rejected too 
+		valid &= ((array >= 0) & (array <= 1)).all(axis = 1)
+	return valid
+
+# Reads every dataset in a binary dataset folder. Yields (subject, data, error) like iterDataRecords. 
+# The range of every value is checked at once when the folder is opened. 
+def iterBinaryRecords(folder): 
+	header, sections, subjects = loadBinaryDataset(folder)
+	valid = findValidRows(sections)
+
+	# Rows are converted to lists a block at a time, which is much faster than one row at a time 
+	for start in range(0, header["subjects"], BINARY_BLOCK_SIZE): 
+		stop = min(start + BINARY_BLOCK_SIZE, header["subjects"])
+		blocks = [array[start:stop].tolist() for name, label, abrv, array in sections]
+		for i, subject in enumerate(subjects[start:stop].tolist()): 
+			if not valid[start + i]: 
+				names = [s[0] for s, block in zip(sections, blocks) if not all(0 <= v <= 1 for v in block[i])]
+				yield subject, None, "All data points must be in range [0,1] inclusive. Error found in: " + names[0]
+				continue
+			yield subject, [[s[0], s[1], s[2], block[i]] for s, block in zip(sections, blocks)], None
+
+# Gets data from a binary dataset folder that holds a single dataset 
+# Returns a list of lists
+def getDataFromBinaryDataset(folder): 
 	try: 
-		# Get default settings
-		default = configparser.ConfigParser()
-		default.read_file(open(defaultSettingsFile))
-
-		# Get initial settings 
-		settings = configparser.ConfigParser()
-		settings.read_file(open(filepath))
-
-		# try: 
-		for section in settings.sections():
-			for option in settings.options(section):
-				if settings[section][option] == "" or settings[section][option] is None: 
-					d = default[section][option]
-					settings.set(section, option, d)
-		with filepath.open('w') as configfile:
-			settings.write(configfile)
-	except: 
-		print("Something went wrong. Ensure that default.ini has not been modified and that the sections and option names in"
-			"settings.ini have not been modified.")
+		header, sections, subjects = loadBinaryDataset(folder)
+		assert(header["subjects"] == 1)
+	except (OSError, ValueError, KeyError, AssertionError) as e: 
+		print("Something went wrong. We can't access data from ", folder, "Binary dataset folders must hold exactly one "
+			"dataset to be fit on their own (use batch mode for more). See README for instructions. ")
+		sys.exit(1) 
+	subject, data, error = next(iterBinaryRecords(folder))
+	if error is not None: 
+		print("Error: " + error + "\n")
 		sys.exit(1)
-
-	return 0 
-
-
-
-
-
-
-
+	return data
@@ -0,0 +1,127 @@
+'''
+fitcache.py
+Stores fit results on disk so that repeated runs with the same data, model and settings skip the fit.
+'''
+
+# Imports #
+
+import os
+import json
+import inspect
+import hashlib
+
+from models import *
+from fileparser import *
+
+# Globals #
+
+cacheFolder = resultsFolder / ".cache"
+
+# Settings that change the result of a fit. Other settings (such as graph labels) do not affect the cache.
+FIT_SETTINGS = [("fit_settings", "multistart"), ("fit_settings", "multistart_keep"), ("fit_settings", "seed"), 
+	("fit_settings", "reparameterize")]
+
+# Cache Functions #
+
+# Returns the cache key for fitting a model to data
+# The key is a hash of the data, the model's source code (with its Jacobian and the helper functions they call) and
+# the settings that affect the fit, so editing a model in models.py automatically stops old results for that model
+# from being used.
+def getCacheKey(settings, data):
+	model = MODEL_LIST[settings["data_settings"]["model_number"]]
+	content = {
+		"data": data,
+		"model": getModelSource(model),
+		"settings": [settings[section][option] for section, option in FIT_SETTINGS],
+	}
+	text = json.dumps(content, sort_keys = True)
+	return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+# Returns the cached optimal parameters for a key, or None if there is no cached result
+def loadCachedResult(key):
+	path = cacheFolder / (key + ".json")
+	try:
+		with path.open() as f:
+			entry = json.load(f)
+		# Mark the entry as recently used
+		os.utime(path)
+	except (OSError, ValueError):
+		return None
+	return entry["parameters"]
+
+# Saves optimal parameters under a key and evicts the least recently used entries if the cache is too large
+def saveCachedResult(key, optimalParams, modelName = "", maxSize = 100 * 1024 * 1024):
+	cacheFolder.mkdir(parents = True, exist_ok = True)
+	parameters = [[float(v) for v in p] if isinstance(p, list) else float(p) for p in optimalParams]
+	entry = {"model": modelName, "parameters": parameters}
+
+	# Write to a temporary file first so that other runs never read a partial entry
+	path = cacheFolder / (key + ".json")
+	temporaryPath = cacheFolder / (key + "." + str(os.getpid()) + ".tmp")
+	with temporaryPath.open("w") as f:
+		json.dump(entry, f)
+	os.replace(temporaryPath, path)
+
+	evictCache(maxSize)
+
+# Removes the least recently used entries until the cache is no larger than maxSize (in bytes)
+def evictCache(maxSize):
+	entries = []
+	for path in cacheFolder.glob("*.json"):
+		try:
+			info = path.stat()
+		except OSError:
+			continue
+		entries.append((info.st_mtime, info.st_size, path))
+
+	total = sum(size for _, size, _ in entries)
+	for _, size, path in sorted(entries, key = lambda e: e[0]):
+		if total <= maxSize:
+			break
+		try:
+			path.unlink()
+		except OSError:
+			pass
+		total -= size
+
+
+# Helper Functions #
+
+# Returns the source code of a model, its Jacobian (if it has one) and every function from the same module that
+# they call (such as factorGrid), so that editing a helper function also changes the source
+def getModelSource(model):
+	functions = [model] + ([model.jacobian] if hasattr(model, "jacobian") else [])
+	return model.__name__ + "\n" + "\n".join(getSource(f) for f in getCalledFunctions(functions))
+
+# Returns functions and every function from their own module that they refer to by name (directly or through other
+# such functions), in the order they are found
+def getCalledFunctions(functions):
+	found = []
+	pending = list(functions)
+	while len(pending) > 0:
+		function = pending.pop(0)
+		if function in found:
+			continue
+		found.append(function)
+		if not inspect.isfunction(function):
+			continue
+		for name in getCodeNames(function.__code__):
+			value = function.__globals__.get(name)
+			if inspect.isfunction(value) and value.__module__ == function.__module__:
+				pending.append(value)
+	return found
+
+# Returns the global names used by compiled code, including the code of functions and comprehensions inside it
+def getCodeNames(code):
+	names = list(code.co_names)
+	for constant in code.co_consts:
+		if inspect.iscode(constant):
+			names += getCodeNames(constant)
+	return names
+
+# Returns the source code of a function, or its compiled code if the source is not available
+def getSource(function):
+	try:
+		return inspect.getsource(function)
+	except (OSError, TypeError):
+		return function.__code__.co_code.hex()
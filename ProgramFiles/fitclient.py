@@ -0,0 +1,82 @@
+'''
+fitclient.py
+Sends a fit job to a running fit server (see fitserver.py) and prints the result as JSON. Run from the
+ProgramFiles directory:
+
+	python3 fitclient.py rdata.json --model 1 [--graph Graph_rdata.png] [--report] [--port 8765]
+
+The data file is looked up in the UserData folder (or used as given if it is a path to an existing file).
+The graph, if requested, is saved to the UserResults folder. With --report, the readable text report is printed
+after the JSON result.
+'''
+
+# Imports #
+
+import sys
+import json
+import base64
+import argparse
+import urllib.request
+import urllib.error
+from pathlib import Path
+
+# Filepaths (the client does not import the fitting modules so that it starts quickly)
+dataFolder = Path("../UserData")
+resultsFolder = Path("../UserResults")
+
+# Client Functions #
+
+# Sends a job to the server and returns the response (a dictionary)
+def sendJob(job, host = "127.0.0.1", port = 8765):
+	request = urllib.request.Request("http://" + host + ":" + str(port) + "/fit", data = json.dumps(job).encode("utf-8"),
+		headers = {"Content-Type": "application/json"})
+	try:
+		with urllib.request.urlopen(request) as response:
+			return json.load(response)
+	except urllib.error.HTTPError as e:
+		return json.load(e)
+
+# Sends a data file to the server. Saves the graph if graphFile is given. Asks for the text report if report is True.
+# Returns the response.
+def fitFile(dataFile, modelNumber, graphFile = None, settings = None, host = "127.0.0.1", port = 8765, report = False):
+	path = Path(dataFile)
+	if not path.exists():
+		path = dataFolder / dataFile
+	with open(path) as f:
+		objects = json.load(f)
+
+	job = {"model_number": modelNumber, "data": objects, "graph": graphFile is not None, "report": report}
+	if settings is not None:
+		job["settings"] = settings
+	response = sendJob(job, host, port)
+
+	# Save graph
+	if "graph_png" in response:
+		with open(resultsFolder / graphFile, "wb") as f:
+			f.write(base64.b64decode(response.pop("graph_png")))
+	return response
+
+
+# RUN MAIN #
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Send a fit job to a running fit server.")
+	parser.add_argument("data_file", help = "data file (in UserData or a path)")
+	parser.add_argument("--model", type = int, required = True, help = "model number (index in MODEL_LIST)")
+	parser.add_argument("--graph", help = "save the graph to this file in UserResults")
+	parser.add_argument("--report", action = "store_true", help = "also print the readable text report")
+	parser.add_argument("--host", default = "127.0.0.1", help = "server address (default 127.0.0.1)")
+	parser.add_argument("--port", type = int, default = 8765, help = "server port (default 8765)")
+	args = parser.parse_args()
+
+	try:
+		response = fitFile(args.data_file, args.model, args.graph, host = args.host, port = args.port, report = args.report)
+	except (OSError, ValueError) as e:
+		print("Error:", e)
+		sys.exit(1)
+
+	report = response.pop("report", None)
+	print(json.dumps(response, indent = 2))
+	if report is not None:
+		print(report)
+	sys.exit(1 if "error" in response else 0)
@@ -0,0 +1,167 @@
+'''
+fitserver.py
+A local fitting server. Keeps the models and the fitting code loaded and fits jobs sent over HTTP, so that
+scripts and web frontends do not pay the program's startup time for every fit. Run from the ProgramFiles directory:
+
+	python3 fitserver.py [--port 8765] [--workers N]
+
+Send jobs with fitclient.py, or POST JSON to http://127.0.0.1:8765/fit:
+
+	{"model_number": 1, "data": [...], "graph": false, "report": false, "settings": {"general_settings": {"rounding": "3"}}}
+
+"data" uses the same format as the files in UserData. "settings" is optional and overrides settings.ini.
+The response contains the model name, the optimal parameters (by name), the RMSD, the solver status and timings,
+plus the graph as a base64 encoded PNG if "graph" is true and the readable text report (with the fit trace and
+tables, as in a result file) if "report" is true. Building the report takes longer than most fits, so it is only
+made when asked for. GET /models lists the available models.
+'''
+
+# Imports #
+
+import io
+import sys
+import json
+import base64
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from modelfitting import *
+from batchfitting import getErrorStatus
+from config import *
+
+# Largest request accepted (in bytes)
+MAX_REQUEST_SIZE = 16 * 1024 * 1024
+
+# Fit Jobs #
+
+# Fits one job. Runs inside a worker process. The text report is only built if report is True.
+def fitRequest(settings, objects, drawGraph = False, report = False):
+
+	log = io.StringIO()
+	writer = ResultWriter(wantsText = report)
+	with contextlib.redirect_stdout(log):
+		try:
+			data = getDataFromObjects(objects)
+			if report:
+				optimalParams = fitModel(settings, data, writer)
+			else:
+				with writer.timer("fit"):
+					problem, optimalParams, result = solveModel(settings, data)
+				writer.set(solver = getSolverRecord(result))
+				printFitResult(problem, optimalParams, writer)
+
+			graph = None
+			if drawGraph:
+				buffer = io.BytesIO()
+				with writer.timer("graph"):
+					drawFitGraph(settings, data, optimalParams, buffer)
+				graph = base64.b64encode(buffer.getvalue()).decode("ascii")
+		except (Exception, SystemExit) as e:
+			return {"error": getErrorStatus(e, log).replace("error: ", "", 1)}
+	writer.close()
+
+	record = writer.record
+	response = {"model": record["model"], "parameters": record["parameters"], "rmsd": record["rmsd"],
+		"solver": record["solver"], "timings": record["timings"]}
+	if graph is not None:
+		response["graph_png"] = graph
+	if report:
+		response["report"] = writer.getText()
+	return response
+
+# Loads the heavy modules once when a worker starts instead of during its first job
+def warmWorker():
+	import matplotlib.figure
+	import matplotlib.backends.backend_agg
+	import pandas
+
+
+# Server #
+
+class FitRequestHandler(BaseHTTPRequestHandler):
+
+	# Set by runServer
+	pool = None
+	settings = None
+
+	def do_GET(self):
+		if self.path.rstrip("/") == "/models":
+			self.sendJSON(200, {"models": [m.__name__ for m in MODEL_LIST]})
+		else:
+			self.sendJSON(404, {"error": "Unknown path " + self.path})
+
+	def do_POST(self):
+		if self.path.rstrip("/") != "/fit":
+			self.sendJSON(404, {"error": "Unknown path " + self.path})
+			return
+
+		# Read job
+		try:
+			size = int(self.headers.get("Content-Length", 0))
+			assert(0 < size <= MAX_REQUEST_SIZE)
+			job = json.loads(self.rfile.read(size))
+			settings = makeJobSettings(self.settings, job)
+			objects = job["data"]
+			assert(isinstance(objects, list))
+		except Exception:
+			self.sendJSON(400, {"error": "Expected a JSON job with model_number and data. See fitserver.py for the format."})
+			return
+
+		# Fit in a worker process. This thread waits while other requests are handled by other threads.
+		response = self.pool.submit(fitRequest, settings, objects, bool(job.get("graph", False)),
+			bool(job.get("report", False))).result()
+		self.sendJSON(400 if "error" in response else 200, response)
+
+	def sendJSON(self, status, content):
+		body = json.dumps(content).encode("utf-8")
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	# Only log errors
+	def log_message(self, format, *args):
+		pass
+
+# Combines the server settings with a job's model number and settings overrides
+def makeJobSettings(settings, job):
+	jobSettings = settings.override(job.get("settings", {}))
+	modelNumber = job.get("model_number", jobSettings["data_settings"]["model_number"])
+
+	# Jobs already run in parallel, so each job fits with a single process
+	return jobSettings.override({"data_settings": {"model_number": modelNumber}, "general_settings": {"workers": 1}})
+
+# Starts the server and handles requests until interrupted
+def runServer(port = 8765, workers = 0, settingsFile = userSettingsFile):
+
+	try:
+		FitRequestHandler.settings = loadSettings(settingsFile, defaultSettingsFile)
+	except SettingsError as e:
+		print("Error:", e)
+		return 1
+	workers = getWorkerCount(workers)
+
+	with ProcessPoolExecutor(max_workers = workers, initializer = warmWorker) as pool:
+		FitRequestHandler.pool = pool
+		server = ThreadingHTTPServer(("127.0.0.1", port), FitRequestHandler)
+		print("Fit server listening on http://127.0.0.1:" + str(port) + " with", workers, "workers. Press Ctrl+C to stop.")
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			server.server_close()
+	return 0
+
+
+# RUN MAIN #
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Run a local model fitting server.")
+	parser.add_argument("--port", type = int, default = 8765, help = "port to listen on (default 8765)")
+	parser.add_argument("--workers", type = int, default = 0, help = "number of worker processes (default: one per CPU)")
+	args = parser.parse_args()
+	sys.exit(runServer(args.port, args.workers))
@@ -0,0 +1,67 @@
+'''
+jacobiancheck.py
+Checks the analytic Jacobian of every model in MODEL_LIST that has one (see @jacobian in models.py). Run from the
+ProgramFiles directory:
+
+	python3 jacobiancheck.py [--trials 5] [--tolerance 1e-5] [--seed 0]
+
+Each Jacobian is compared against central finite differences (see checkJacobian in modelfitting.py) at random
+parameter values. Parameters named like a_params are factors and get a different number of levels each (so a
+mixed-up axis is caught); other parameters (such as bias) are single values. Fails if any difference is larger
+than the tolerance.
+'''
+
+# Imports #
+
+import sys
+import inspect
+import argparse
+import numpy as np
+
+from modelfitting import *
+
+# Number of levels of the first factor (each later factor has one more)
+FACTOR_LEVELS = 3
+
+# Check Functions #
+
+# Returns random parameter values in (0.05, 0.95) for a model, in the format passed to the model
+def makeRandomParams(model, rng):
+	params = []
+	factors = 0
+	for p in inspect.signature(model).parameters.values():
+		if p.name.endswith("_params"):
+			params.append(list(rng.uniform(0.05, 0.95, FACTOR_LEVELS + factors)))
+			factors += 1
+		else:
+			params.append(float(rng.uniform(0.05, 0.95)))
+	return params
+
+# Checks every model with an analytic Jacobian at trials random parameter values
+# Returns a dictionary of model name to the largest difference from finite differences
+def checkJacobians(trials = 5, seed = 0):
+	rng = np.random.default_rng(seed)
+	differences = {}
+	for model in MODEL_LIST:
+		if not hasattr(model, "jacobian"):
+			continue
+		differences[model.__name__] = max(float(checkJacobian(model, makeRandomParams(model, rng))) for i in range(trials))
+	return differences
+
+
+# RUN MAIN #
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Check analytic model Jacobians against finite differences.")
+	parser.add_argument("--trials", type = int, default = 5, help = "random parameter values per model (default 5)")
+	parser.add_argument("--tolerance", type = float, default = 1e-5, help = "largest allowed difference (default 1e-5)")
+	parser.add_argument("--seed", type = int, default = 0, help = "random seed of the parameter values (default 0)")
+	args = parser.parse_args()
+
+	failed = False
+	for name, difference in checkJacobians(args.trials, args.seed).items():
+		print(name.ljust(12), "largest difference", "%.2e" % difference)
+		if not difference <= args.tolerance:
+			print("FAIL:", name, "Jacobian differs from finite differences by more than", args.tolerance)
+			failed = True
+	sys.exit(1 if failed else 0)
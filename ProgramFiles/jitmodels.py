@@ -0,0 +1,86 @@
+'''
+jitmodels.py
+Optional compiled backend for loop-style models (see general_settings jit). Loop-style models in models.py are
+compiled to native code with numba the first time they are used, which makes their loops as fast as vectorized
+NumPy. Compiled code is cached on disk (in UserResults/.cache/numba), so later runs skip compiling. If numba is not
+installed, or a model uses Python that numba cannot compile, the model runs as plain Python.
+'''
+
+# Imports #
+
+import os
+import functools
+import numpy as np
+
+from fitcache import cacheFolder
+
+# numba is imported on first use, since it is optional and slow to import. False if it is not installed.
+numbaModule = None
+
+# Compiled wrapper of each model, so a model is compiled once per process
+compiledModels = {}
+
+# Main Interface #
+
+# Returns a version of model that runs compiled, or model itself if it does not need compiling. Vectorized models
+# already run as NumPy code, so only loop-style models are compiled.
+def compileModel(model):
+	if getattr(model, "vectorized", False) or isinstance(model, JitModel):
+		return model
+	if model not in compiledModels:
+		compiledModels[model] = JitModel(model)
+	return compiledModels[model]
+
+# A loop-style model that is compiled with numba on its first call. It is called like the model itself and keeps
+# the model's name, signature and attributes (such as its Jacobian).
+# Parameters are passed to the compiled model as NumPy arrays (factors) and floats (single values).
+class JitModel:
+
+	def __init__(self, model):
+		functools.update_wrapper(self, model)
+		self.model = model
+		self.compiled = None
+
+	def __call__(self, *params):
+		if self.compiled is None:
+			self.compiled = compileFunction(self.model)
+		if self.compiled is self.model:
+			return self.model(*params)
+
+		try:
+			return self.compiled(*[np.asarray(p, dtype=float) if isinstance(p, (list, tuple, np.ndarray)) else float(p)
+				for p in params])
+		except numbaModule.core.errors.NumbaError as e:
+			# Compiling happens on the first call, so a model numba cannot compile fails here
+			print("Note:", self.model.__name__, "could not be compiled with numba, so it runs as plain Python.",
+				str(e).strip().splitlines()[0])
+			self.compiled = self.model
+			return self.model(*params)
+
+	# Worker processes get the model itself and compile it again (which loads the compiled code from the disk cache)
+	def __reduce__(self):
+		return (compileModel, (self.model,))
+
+
+# Helper Functions #
+
+# Returns model compiled with numba (compiled on its first call and cached on disk), or model itself if numba is not
+# installed
+def compileFunction(model):
+	numba = getNumba()
+	if numba is None:
+		return model
+	return numba.njit(cache = True)(model)
+
+# Imports numba on first use. Returns the module, or None if numba is not installed (a note is printed once).
+def getNumba():
+	global numbaModule
+	if numbaModule is None:
+		os.environ.setdefault("NUMBA_CACHE_DIR", str(cacheFolder / "numba"))
+		try:
+			import numba
+			numbaModule = numba
+		except ImportError:
+			print("Note: numba is not installed, so models run as plain Python. Install it with: pip3 install numba")
+			numbaModule = False
+	return numbaModule or None
@@ -0,0 +1,114 @@
+'''
+landscape.py
+Maps the fit landscape: the RMSD as one or two parameters move over [0,1] while the others stay at their optimal
+values. A long flat valley shows a parameter (or a pair of parameters) that the data cannot pin down.
+'''
+
+# Imports #
+
+import numpy as np
+from pathlib import Path
+
+from modelfitting import *
+
+# Main Interface #
+
+# Computes the landscape of the parameters named in the landscape setting (graph_settings) around the optimal
+# parameters, draws it next to the graph and reports where its minimum is
+# optimalParams: the parameters returned by fitModel
+# output (optional): a file or buffer to write the PNG to instead of the landscape file next to the graph file
+# writer (optional): the ResultWriter that the result is reported to. By default it is printed.
+def runLandscape(settings, data, optimalParams, writer = None, output = None):
+
+	# Settings for easy access
+	names = [n.strip() for n in settings["graph_settings"]["landscape"].split(",") if n.strip() != ""]
+	points = settings["graph_settings"]["landscape_points"]
+
+	problem = FitProblem(settings, data)
+	flatParams, paramIndex = flattenParameters(*optimalParams)
+	optimal = np.array(flatParams, dtype=float)
+
+	try:
+		indexes = findParameters(problem, names)
+		assert(points >= 2)
+	except ValueError as e:
+		print("Error:", e)
+		return None
+	except AssertionError:
+		print("Error: The landscape_points setting (in settings.ini) must be 2 or more.")
+		return None
+
+	with useWriter(writer) as writer:
+		with writer.timer("landscape"):
+			values, rmsd = computeLandscape(problem, optimal, indexes, points)
+			job = makeLandscapeJob(problem, optimal, indexes, values, rmsd)
+			if output is None:
+				output = getLandscapePath(settings)
+				np.savez_compressed(output.with_name(output.stem + ".npz"), names = np.array(job["names"]),
+					values = np.array(values), rmsd = rmsd, optimal = optimal[indexes])
+			renderLandscape(job, output)
+
+		# Report the lowest point of the landscape (on the grid) and the RMSD at the optimum
+		rounding = problem.rounding
+		lowest = np.unravel_index(np.nanargmin(rmsd), rmsd.shape)[::-1]
+		lowestValues = [float(v[i]) for v, i in zip(values, lowest)]
+		writer.set(landscape = {"parameters": job["names"], "points": points, "lowest": lowestValues,
+			"lowest_rmsd": float(np.nanmin(rmsd)), "file": str(output) if isinstance(output, (str, Path)) else None})
+		writer.write()
+		writer.write("Fit Landscape")
+		writer.write()
+		writer.write("RMSD over " + " and ".join(job["names"]) + " (" + str(points) + " values" + (" each" if len(indexes) == 2 else "")
+			+ ", other parameters at their optimal values)")
+		writer.write("Lowest RMSD", round(float(np.nanmin(rmsd)), rounding), "at", ", ".join(name + " = " + str(round(v, rounding))
+			for name, v in zip(job["names"], lowestValues)))
+		writer.write("RMSD at the optimum", round(getRMSD(problem.residuals(optimal)), rounding))
+
+	return values, rmsd
+
+
+# Landscape Functions #
+
+# Computes the RMSD on a grid of points values in [0,1] for each parameter in indexes (positions in the flat
+# parameter vector, one or two). Every other parameter stays at its optimal value. Points where the model is not 
+# defined (such as 0/0 at the edges of the grid) have an RMSD of NaN.
+# Returns the grid of each parameter and the RMSD: a (points,) array for one parameter, or a (points, points)
+# array for two parameters with one row per value of the second parameter.
+def computeLandscape(problem, optimal, indexes, points = 51):
+	grid = np.linspace(0, 1, points)
+	values = [grid for i in indexes]
+	mesh = np.meshgrid(*values)
+	paramMatrix = np.tile(optimal, (mesh[0].size, 1))
+	for i, m in zip(indexes, mesh):
+		paramMatrix[:, i] = m.ravel()
+	with np.errstate(divide = "ignore", invalid = "ignore"):
+		residuals, rmsd = evaluateBatch(problem, paramMatrix, keepResiduals = False)
+	return values, rmsd.reshape(mesh[0].shape) if len(indexes) == 2 else rmsd
+
+# Returns the position in the flat parameter vector of each parameter name. Names are those shown in the result
+# (such as A1 or Bias, see FitProblem.parameterNames), or the section name of a single valued parameter (such as
+# bias), in any case. Raises ValueError if a name is unknown or there are not one or two names.
+def findParameters(problem, names):
+	if len(names) not in [1, 2]:
+		raise ValueError("The landscape setting (in settings.ini) must name one or two parameters, such as Bias or A1, V1.")
+	known = {name.lower(): i for i, name in enumerate(problem.parameterNames())}
+	for p, (s, isGroup) in zip(problem.parameterData, problem.slices):
+		if not isGroup:
+			known[p[0].lower()] = s.start
+	indexes = []
+	for name in names:
+		if name.lower() not in known:
+			raise ValueError("Unknown parameter " + name + " in the landscape setting. Use one of " + ", ".join(problem.parameterNames()) + ".")
+		indexes.append(known[name.lower()])
+	return indexes
+
+# Makes the render job for a landscape (see renderLandscape in rendering.py)
+def makeLandscapeJob(problem, optimal, indexes, values, rmsd):
+	names = [problem.parameterNames()[i] for i in indexes]
+	return {"title": problem.model.__name__ + " fit landscape", "names": names, "values": [list(v) for v in values],
+		"rmsd": rmsd.tolist(), "optimal": [float(optimal[i]) for i in indexes]}
+
+# Returns the landscape file: the graph file name (without its extension) with _landscape.png added, in the
+# UserResults folder
+def getLandscapePath(settings):
+	graphFile = Path(settings["graph_settings"]["graph_filename"])
+	return resultsFolder / (graphFile.stem + "_landscape.png")
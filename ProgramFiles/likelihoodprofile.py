@@ -0,0 +1,188 @@
+'''
+likelihoodprofile.py
+Shows how sharply the data determines each parameter (profile likelihood). Each parameter in the flat parameter
+vector is fixed at a grid of values in [0,1] and the other parameters are refit at every value. The lowest sum of
+squared errors (SSE) at each value is the parameter's profile; values where the profile stays close to the best
+fit form a likelihood-based confidence interval.
+'''
+
+# Imports #
+
+import csv
+import math
+import numpy as np
+
+from modelfitting import *
+
+# Fixed values are kept this far inside [0,1], where some models are not defined (such as 0/0 in the FLMP)
+PROFILE_EDGE = 1e-4
+
+# Interval ends are found to within this distance (see findCrossing)
+PROFILE_TOLERANCE = 1e-5
+
+# Main Interface #
+
+# Profiles every parameter of a fitted model and reports a likelihood-based interval for each one. The profile
+# curves are saved next to the result file (result_filename plus _profile.csv).
+# optimalParams: the parameters returned by fitModel
+# writer (optional): the ResultWriter that the intervals are reported to. By default they are printed.
+def runLikelihoodProfile(settings, data, optimalParams, writer = None):
+
+	# Settings for easy access
+	points = settings["fit_settings"]["likelihood_profile"]
+	confidence = settings["fit_settings"]["confidence"]
+	workers = settings["general_settings"]["workers"]
+
+	if points < 2:
+		print("Error: The likelihood_profile setting (in settings.ini) must be 2 or more (or 0 to turn it off).")
+		return None
+
+	problem = FitProblem(settings, data)
+	flatParams, paramIndex = flattenParameters(*optimalParams)
+	optimal = np.array(flatParams, dtype=float)
+	names = problem.parameterNames()
+
+	# Every value whose SSE is below the threshold is inside the interval
+	residuals = problem.residuals(optimal)
+	threshold = getThreshold(float(np.dot(residuals, residuals)), len(residuals), confidence)
+
+	with useWriter(writer) as writer:
+		with writer.timer("likelihood_profile"):
+			grid, profiles, intervals = profileParameters(problem, optimal, points, threshold, workers)
+
+		# Save the profile curves
+		curveFile = settings["data_settings"]["result_filename"] + "_profile.csv"
+		saveProfiles(resultsFolder / curveFile, names, grid, profiles)
+
+		# Report intervals
+		rounding = problem.rounding
+		writer.set(likelihood_profile = {"points": points, "confidence": confidence, "threshold_sse": threshold,
+			"file": curveFile, "intervals": {name: list(interval) for name, interval in zip(names, intervals)}})
+		writer.write()
+		writer.write("Profile Likelihood Intervals")
+		writer.write()
+		writer.write(str(round(confidence * 100, 2)) + "% intervals from " + str(points) + " values per parameter (profiles "
+			"saved to " + curveFile + "). An interval that reaches 0 or 1 is not bounded by the data.")
+		writer.write()
+		for name, estimate, (low, high) in zip(names, optimal, intervals):
+			writer.write(name, round(estimate, rounding), "[" + str(round(low, rounding)) + ", " + str(round(high, rounding)) + "]")
+
+	return grid, profiles, intervals
+
+# Profiles every parameter and finds its interval (the values whose SSE is at most threshold). Parameters are
+# profiled in parallel worker processes.
+# Returns the grid of fixed values of each parameter and the profile (lowest SSE at each value), both as
+# (parameters, points) arrays, and the (lower, upper) interval of each parameter.
+def profileParameters(problem, optimal, points, threshold, workers = 0):
+	results = mapWorkers(profileParameter, (problem, optimal, points, threshold), range(problem.numParams), workers)
+	grid = np.array([g for g, sse, interval in results])
+	profiles = np.array([sse for g, sse, interval in results])
+	return grid, profiles, [interval for g, sse, interval in results]
+
+
+# Profile Functions #
+
+# Profiles one parameter (its position in the flat parameter vector). The sweep starts at the grid value nearest
+# the optimum and moves outwards in both directions. Each refit starts from the solution of the neighbouring value,
+# so it only needs a few iterations. state: the problem, its optimal parameters, the number of grid values and the
+# interval threshold (see mapWorkers in modelfitting.py).
+# Returns the grid of fixed values, the lowest SSE at each value and the interval (see likelihoodInterval).
+def profileParameter(state, index):
+	problem, optimal, points, threshold = state
+	grid = np.clip(np.linspace(0, 1, points), PROFILE_EDGE, 1 - PROFILE_EDGE)
+	sse = np.empty(points)
+	solutions = np.empty((points, problem.numParams))
+
+	nearest = int(np.argmin(np.abs(grid - optimal[index])))
+	for direction in [range(nearest, points), range(nearest - 1, -1, -1)]:
+		start = optimal
+		for i in direction:
+			start = solutions[i] = fitFixed(problem, index, grid[i], start)
+			sse[i] = getSSE(problem, start)
+
+	return grid, sse, likelihoodInterval(problem, index, grid, sse, solutions, threshold, optimal)
+
+# Refits every parameter except index, which is fixed at value. start: the flat parameter vector to start from.
+# Returns the full flat parameter vector of the fit.
+def fitFixed(problem, index, value, start):
+	free = np.arange(problem.numParams) != index
+
+	def fill(freeParams):
+		flatParams = np.empty(problem.numParams)
+		flatParams[free] = freeParams
+		flatParams[index] = value
+		return flatParams
+
+	def residuals(freeParams):
+		return problem.residuals(fill(freeParams))
+
+	# Use the model's analytic Jacobian (without the fixed parameter's column) if it has one
+	jac = "2-point"
+	if hasattr(problem.model, "jacobian"):
+		def jac(freeParams):
+			return problem.jacobian(fill(freeParams))[:, free]
+
+	result = leastSquares(problem, residuals, np.clip(start[free], 0, 1), jac)
+	return fill(result.x)
+
+# Returns the largest SSE inside a likelihood-based interval. With normally distributed errors, the likelihood
+# ratio test of one parameter gives n log(SSE / best SSE) <= the chi-squared (1 degree of freedom) quantile.
+def getThreshold(bestSSE, n, confidence = 0.95):
+	from scipy import stats
+
+	return bestSSE * math.exp(stats.chi2.ppf(confidence, 1) / n)
+
+# Returns the lower and upper end of the interval around the optimum where the profile of a parameter is below
+# threshold. The optimum (with its SSE) is added to the profile, so an interval narrower than the grid spacing is
+# still found. Between the last grid value inside and the first value outside, the end is found by refitting (see
+# findCrossing), since the SSE is curved there. An end is 0 or 1 if the profile does not rise above threshold
+# before the edge. solutions: the fitted flat parameter vector at each grid value.
+def likelihoodInterval(problem, index, grid, sse, solutions, threshold, optimal):
+	order = np.argsort(np.append(grid, optimal[index]), kind = "stable")
+	grid = np.append(grid, optimal[index])[order]
+	sse = np.append(sse, getSSE(problem, optimal))[order]
+	solutions = np.vstack((solutions, optimal))[order]
+	centre = int(np.flatnonzero(order == len(order) - 1)[0])
+
+	# Walk outwards from the estimate until the profile rises above threshold
+	low = centre
+	while low > 0 and sse[low - 1] <= threshold:
+		low -= 1
+	high = centre
+	while high < len(grid) - 1 and sse[high + 1] <= threshold:
+		high += 1
+
+	lower = 0.0
+	if low > 0:
+		lower = findCrossing(problem, index, grid[low], grid[low - 1], solutions[low], threshold)
+	upper = 1.0
+	if high < len(grid) - 1:
+		upper = findCrossing(problem, index, grid[high], grid[high + 1], solutions[high], threshold)
+	return lower, upper
+
+# Returns the value between inside (SSE at most threshold) and outside (SSE above threshold) where the profile
+# crosses threshold, found by bisection to within PROFILE_TOLERANCE. Each refit starts from the last solution
+# inside the interval. start: the flat parameter vector fitted at inside.
+def findCrossing(problem, index, inside, outside, start, threshold):
+	while abs(outside - inside) > PROFILE_TOLERANCE:
+		middle = (inside + outside) / 2
+		params = fitFixed(problem, index, middle, start)
+		if getSSE(problem, params) <= threshold:
+			inside, start = middle, params
+		else:
+			outside = middle
+	return float((inside + outside) / 2)
+
+# Returns the sum of squared errors of a flat parameter vector
+def getSSE(problem, flatParams):
+	residuals = problem.residuals(flatParams)
+	return float(np.dot(residuals, residuals))
+
+# Saves the profile curves to a CSV file with one row per parameter value: parameter, value, SSE
+def saveProfiles(filepath, names, grid, profiles):
+	with open(filepath, "w", newline = "") as f:
+		writer = csv.writer(f)
+		writer.writerow(["parameter", "value", "sse"])
+		for name, values, sse in zip(names, grid, profiles):
+			for v, s in zip(values, sse):
+				writer.writerow([name, float(v), float(s)])
@@ -7,180 +7,631 @@ https://docs.scipy.org/doc/scipy/reference/generated/scipy.optimize.least_square
 
 # Imports # 
 
+import os
+import sys
+import copy
 import math
+import functools
+import contextlib
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib import cm 
-from scipy.optimize import curve_fit, least_squares
-from scipy import interpolate
+from scipy.optimize import least_squares
+from scipy.special import expit
 
 import inspect
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 from collections.abc import Iterable
 
 from models import * 
 from fileparser import * 
+from fitcache import * 
+from jitmodels import * 
+from rendering import * 
+from resultwriter import * 
+
+# Memory used at a time (in bytes) when evaluating many parameter vectors (see evaluateBatch)
+BATCH_MEMORY = 32 * 1024 * 1024
+
+# Parameters are kept this far inside (0,1) in the logit reparameterization (see toLogit and fromLogit)
+LOGIT_EDGE = 1e-6
 
 # Main interface 
-def runModelFitting(settings, data):
+# Fits the model, reports the result and draws the graph (unless drawGraph is False)
+# writer (optional): the ResultWriter that the result is reported to (see resultwriter.py). By default the 
+# result is printed. 
+def runModelFitting(settings, data, drawGraph = True, writer = None):
 
 	# Settings for easy access 
-	modelNumber = int(settings["data_settings"]["model_number"])
+	modelNumber = settings["data_settings"]["model_number"]
 	model = MODEL_LIST[modelNumber]
-	modelSignature = [p.name for p in inspect.signature(model).parameters.values()]
 
-	# Call fitModel
-	result = fitModel(settings, data)
+	# Use a cached result if this data has already been fit with the same model and settings
+	useCache = settings["general_settings"]["cache"]
+	result = None
+	if useCache: 
+		cacheKey = getCacheKey(settings, data)
+		result = loadCachedResult(cacheKey)
+
+	with useWriter(writer) as writer: 
+
+		# Call fitModel
+		if result is None: 
+			result = fitModel(settings, data, writer)
+			if useCache: 
+				maxSize = settings["general_settings"]["cache_size_mb"] * 1024 * 1024
+				saveCachedResult(cacheKey, result, model.__name__, maxSize)
+		else: 
+			writer.write()
+			writer.write("Model Fitting Result (cached)")
+			writer.write()
+			writer.write("This result was loaded from the cache (see general_settings cache), so no fit was run and there is no "
+				"fit trace or solver result.")
+			writer.write()
+			writer.set(status = "cached")
+			printFitResult(FitProblem(settings, data), result, writer)
+
+		# Call graphing 
+		if drawGraph: 
+			with writer.timer("graph"): 
+				drawFitGraph(settings, data, result)
+
+	return result
+
+# Draws the graph of observed data and the model prediction for the optimal parameters 
+# output (optional): a file or buffer to write the PNG to instead of the graph file in settings 
+# renderPool (optional): a RenderPool that draws the graph in another process 
+def drawFitGraph(settings, data, result, output = None, renderPool = None):
+	job = makeFitGraphJob(settings, data, result)
+	return renderGraph(settings, job, output, renderPool)
+
+# Makes the render job for the graph of a fit (see rendering.py)
+def makeFitGraphJob(settings, data, result):
+
+	# Settings for easy access 
+	modelNumber = settings["data_settings"]["model_number"]
+	model = MODEL_LIST[modelNumber]
+	modelSignature = [p.name for p in inspect.signature(model).parameters.values()]
 
 	# Get observed (original) data
-	oParams = [[t[0], t[1], t[2], t[3]] for t in data if t[0] in modelSignature]
-	observedParams = []
-	for i in oParams:
-		observedParams.append(i)
+	observedParams = [[t[0], t[1], t[2], t[3]] for t in data if t[0] in modelSignature]
 	observedComposite = [[t[0], t[1], t[2], t[3]] for t in data if t[0] == "composite"][0]
 
 	# Get final predicted (optimized) data
-	pParams = observedParams
+	predictedParams = [list(p) for p in observedParams]
 	for i, p in enumerate(result): 
-		pParams[i][-1] = p
+		predictedParams[i][-1] = p
 
-	predictedParams = []
-	for i in pParams:
-		predictedParams.append(i)
-	prediction = model(*result)[-1]
+	prediction = list(evaluateModel(model, result))
 	predictedComposite = observedComposite[0:2] + [prediction]
 
-	# Call graphing 
-	drawGraph2Factor(settings, observedParams, observedComposite, predictedParams, predictedComposite)
+	return makeGraph2FactorJob(settings, observedParams, observedComposite, predictedParams, predictedComposite)
 	
 
+# Fit Problem #
+
+# Everything needed to evaluate residuals for one model and one dataset. 
+# Built once per fit so that settings, model lookup and data formatting are not repeated on every evaluation. 
+class FitProblem:
+
+	def __init__(self, settings, data):
+
+		# Settings for easy access
+		self.verbose = settings["general_settings"]["verbose"]
+		self.rounding = settings["general_settings"]["rounding"]
+		self.modelNumber = settings["data_settings"]["model_number"]
+		self.model = MODEL_LIST[self.modelNumber]
+		if settings["general_settings"]["jit"]: 
+			self.model = compileModel(self.model)
+		self.reparameterize = settings["fit_settings"]["reparameterize"]
+		self.modelSignature = [p.name for p in inspect.signature(self.model).parameters.values()]
+
+		# Get parameter names, labels, abreviations, and data. 
+		# Easy access for table and graph drawing. 
+		self.parameterData = [[t[0], t[1], t[2], t[3]] for t in data if t[0] in self.modelSignature]
+		self.compositeData = [t for t in data if t[0] == "composite"][0]
+
+		# Check that the data file has a section for every model parameter
+		names = [t[0] for t in data]
+		for name in self.modelSignature: 
+			if name not in names: 
+				print("Error: No data provided for", name, "(required by " + self.model.__name__ + ")\n")
+				sys.exit(1)
+
+		# Format (flatten) parameter list. These are parameters (free variables) that we can tweak.
+		observedParameterValues = [t[-1] for t in data if t[0] in self.modelSignature]
+		flatParams, self.paramIndex = flattenParameters(*observedParameterValues)
+		self.initialParams = np.array(flatParams, dtype=float)
+		self.numParams = len(flatParams)
+
+		# Slice of the flat parameter vector used by each model parameter (single values are passed as numbers)
+		self.slices = []
+		for start, end in zip(self.paramIndex[:-1], self.paramIndex[1:]):
+			self.slices.append((slice(start, end), end - start > 1))
+
+		# Shape of the prediction grid (one axis per factor, first factor last). The composite data is this grid 
+		# read row by row, so it must have one value for every combination of factor levels. 
+		self.factorShape = getFactorShape(self.parameterData)
+		observedCompositeValues = self.compositeData[-1]
+		if int(np.prod(self.factorShape)) != len(observedCompositeValues): 
+			print("Error: The composite data has", len(observedCompositeValues), "values, but the factors (" 
+				+ " x ".join(str(n) for n in reversed(self.factorShape)) + " levels) have", int(np.prod(self.factorShape)), 
+				"combinations. Check the data file (see README).\n")
+			sys.exit(1)
+
+		# Combine all observed data (parameter and composite) into a single vector. 
+		# This is the data we fit against. 
+		self.observed = np.ascontiguousarray(flatParams + list(observedCompositeValues), dtype=float)
+
+		# Preallocated buffers for the predicted values and the Jacobian. 
+		# The parameter rows of the Jacobian never change (each parameter is fit against its observed value). 
+		self.predictedBuffer = np.empty(len(self.observed))
+		self.jacobianBuffer = np.zeros((len(self.observed), self.numParams))
+		self.jacobianBuffer[:self.numParams] = -np.eye(self.numParams)
+
+		# Optional residual weights (see withObserved)
+		self.weights = None
+
+	# Returns a copy of the problem that is fit against different observed values. 
+	# weights (optional) give the number of times each observed value counts towards the sum of squares. 
+	def withObserved(self, observed, weights = None):
+		problem = copy.copy(self)
+		problem.observed = np.ascontiguousarray(observed, dtype=float)
+		problem.weights = None if weights is None else np.sqrt(np.asarray(weights, dtype=float))
+		problem.predictedBuffer = np.empty(len(problem.observed))
+		problem.jacobianBuffer = self.jacobianBuffer.copy()
+		return problem
+
+	# Returns a name for each value in the flat parameter vector (abbreviation and level number, or the label) 
+	def parameterNames(self):
+		names = []
+		for p, (s, isGroup) in zip(self.parameterData, self.slices):
+			if isGroup: 
+				names.extend([p[2] + str(i + 1) for i in range(s.stop - s.start)])
+			else: 
+				names.append(p[1])
+		return names
+
+	# Transforms a flat parameter vector into the parameters passed to the model
+	def unflatten(self, flatParams):
+		return [flatParams[s] if isGroup else flatParams[s.start] for s, isGroup in self.slices]
+
+	# Returns the model prediction as a flat ndarray
+	def predict(self, flatParams):
+		return evaluateModel(self.model, self.unflatten(flatParams))
+
+	# Returns the residuals (observed - predicted) as a new ndarray
+	def residuals(self, flatParams):
+		predicted = self.predictedBuffer
+		predicted[:self.numParams] = flatParams
+		predicted[self.numParams:] = self.predict(flatParams)
+		residuals = self.observed - predicted
+		if self.weights is not None: 
+			residuals *= self.weights
+		return residuals
+
+	# Returns the residuals of many parameter vectors at once as a (G, N) ndarray 
+	# paramMatrix: a (G, P) array with one flat parameter vector per row 
+	def residualsBatch(self, paramMatrix):
+		paramMatrix = np.asarray(paramMatrix, dtype=float)
+		predicted = np.empty((len(paramMatrix), len(self.observed)))
+		predicted[:, :self.numParams] = paramMatrix
+		predicted[:, self.numParams:] = self.predictBatch(paramMatrix)
+		residuals = self.observed - predicted
+		if self.weights is not None: 
+			residuals *= self.weights
+		return residuals
+
+	# Returns the model prediction of each row of paramMatrix as a (G, composite size) ndarray. 
+	# Vectorized models are called once with every row (each parameter gets a leading axis). Models that do not 
+	# support a leading axis (see vectorized in models.py) are called once per row. 
+	def predictBatch(self, paramMatrix):
+		numRows = len(paramMatrix)
+		numCells = len(self.observed) - self.numParams
+		if getattr(self.model, "vectorized", False): 
+			# Single values get an axis for each factor so that they broadcast against the prediction grid 
+			gridAxes = (1,) * len(self.factorShape)
+			params = [paramMatrix[:, s] if isGroup else paramMatrix[:, s.start].reshape((numRows,) + gridAxes) 
+				for s, isGroup in self.slices]
+			try: 
+				prediction = np.asarray(self.model(*params), dtype=float)
+				if prediction.shape[:1] == (numRows,) and prediction.size == numRows * numCells: 
+					return prediction.reshape(numRows, numCells)
+			except (ValueError, IndexError): 
+				pass
+		return np.array([self.predict(row) for row in paramMatrix]).reshape(numRows, numCells)
+
+	# Returns the Jacobian of the residuals from the model's analytic Jacobian, or None if it has none
+	def jacobian(self, flatParams):
+		if not hasattr(self.model, "jacobian"):
+			return None
+		arrays = [np.asarray(p, dtype=float) for p in self.unflatten(flatParams)]
+		self.jacobianBuffer[self.numParams:] = self.model.jacobian(*arrays)
+		self.jacobianBuffer[self.numParams:] *= -1
+		jacobian = self.jacobianBuffer.copy()
+		if self.weights is not None: 
+			jacobian *= self.weights[:, None]
+		return jacobian
+
+
 # Model Fitting Functions #
  
-def fitModel(settings, data):
+# Fits the model to data and returns the optimal parameters 
+# writer (optional): the ResultWriter that the result is reported to. By default the result is printed. 
+@profiled
+def fitModel(settings, data, writer = None):
 
-	# Settings for easy access
-	verbose = settings["general_settings"]["verbose"]
-	rounding = int(settings["general_settings"]["rounding"])
-	modelNumber = int(settings["data_settings"]["model_number"])
-	model = MODEL_LIST[modelNumber]
-	modelSignature = [p.name for p in inspect.signature(model).parameters.values()]
+	with useWriter(writer) as writer: 
+		return fitProblem(settings, FitProblem(settings, data), writer)
 
-	# Get parameter names, labels, abreviations, and data. 
-	# Easy access for table and graph drawing. Is modified later to reflect optimal parameters.
-	parameterData = [[t[0], t[1], t[2], t[3]] for t in data if t[0] in modelSignature]
-	compositeData = [t for t in data if t[0] == "composite"][0]
+# Fits the model to data without reporting anything (no fit trace, tables or text), for batch and compare mode
+# Returns the FitProblem, the optimal parameters and the scipy result of the fit 
+@profiled
+def solveModel(settings, data):
+	problem = FitProblem(settings, data)
+	result, search = solveFit(settings, problem)
+	return problem, unflattenParams(list(result.x), problem.paramIndex), result
 
-	# Gets values from data input
-	observedParameterValues = [t[-1] for t in data if t[0] in modelSignature]
-	observedCompositeValues = [t[-1] for t in data if t[0] == "composite"][0]
-		
-	# Format (flatten) parameter list. 
-	# These are parameters (free variables) that we can tweak.
-	flatParams, paramIndex = flattenParameters(*observedParameterValues)
+# Fits a FitProblem and reports the fit trace, solver result, RMSD and optimal parameters to writer 
+def fitProblem(settings, problem, writer):
 
-	# Combine all observed data (parameter and composite) into a single list. 
-	# This is the data we fit against. 
-	allObserved = flatParams + observedCompositeValues
+	rounding = problem.rounding
+
+	# Settings for easy access
+	traceStride = settings["general_settings"]["trace_stride"]
+	traceFileName = settings["general_settings"]["trace_filename"]
 
 	# Get optimal parameters (this is the model fitting)
-	# We tweak parameters to minimize the difference between observed parameters + observed composite 
-	# and optimized parameters + model prediction 
-	result = least_squares(getResiduals, flatParams, args = (paramIndex, allObserved, settings, data), bounds=(0,1))
+	trace = FitTrace(problem.numParams, traceStride)
+	result, search = solveFit(settings, problem, trace, writer)
 	resultParams = list(result.x)
 
-	# Print result 
-	print()
-	print("Model Fitting Result")
-	print()
-
-	# Print scipy result if verbose enabled
-	if verbose == "True" or verbose == "true":
-		print(result)
-		print()
-
-	# Make final table (with optimal parameters)
-	optimalParams = unflattenParams(resultParams, paramIndex)
-	optimalPrediction = model(*optimalParams)[-1]
-
-	# Replace initial data with optimal parameters 
-	for i, optimal in enumerate(optimalParams): 
-		parameterData[i][-1] = optimal
-
-	# Draw optimal table 
-	drawTable2Factor(parameterData, optimalPrediction, rounding)
-	print()
-
-	# Print and return optimal parameters (rounded)
-	print("Optimal Parameters")
-	print()
-	for p in parameterData:
-		values = p[-1]
-		if isinstance(values, list): 
-			for i, v in enumerate(values): 
-				values[i] = round(v, rounding)
-		else: 
-			values = round(values, rounding)
-		print(p[1], values)
+	# Report the fit trace (RMSD at each evaluation, and the parameters if verbose) 
+	writer.set(trace = trace.getRecord(problem.verbose))
+	if writer.wantsText: 
+		writer.write("Fit Trace")
+		writer.write()
+		writer.write(trace.formatTable(problem.parameterNames() if problem.verbose else None, rounding))
+
+	# Save the full trace if a trace file is given 
+	if traceFileName != "": 
+		trace.save(resultsFolder / traceFileName, problem.parameterNames())
+
+	# Report result 
+	writer.write()
+	writer.write("Model Fitting Result")
+	writer.write()
+	writer.set(solver = getSolverRecord(result))
+
+	# Report scipy result if verbose enabled
+	if problem.verbose and writer.wantsText:
+		writer.write(result)
+		writer.write()
+
+	# Report multi-start summary 
+	if search is not None: 
+		writer.write("Multi-start: " + str(search["converged"]) + " of " + str(search["solved"]) + " starts converged to the best RMSD (" 
+			+ str(round(search["bestRMSD"], rounding)) + "). " + str(search["screened"]) + " starts were screened out.")
+		writer.write()
+		writer.set(multistart = {"converged": search["converged"], "solved": search["solved"], "screened": search["screened"]})
+
+	# Report final table and return optimal parameters
+	optimalParams = unflattenParams(resultParams, problem.paramIndex)
+	printFitResult(problem, optimalParams, writer)
 
 	return optimalParams
 
+# Fits a FitProblem, searching from several starting points first if multi-start is enabled
+# trace (optional): a FitTrace that records every evaluation of the fit 
+# writer (optional): a ResultWriter that the multi-start and fit times are recorded to 
+# Returns the scipy result of the fit and the multi-start summary (None if multi-start is disabled) 
+def solveFit(settings, problem, trace = None, writer = None):
 
-# Compute and print residuals (actual - predicted)
-def getResiduals(flatParams, paramIndex, allObserved, settings, data):
-
-	# Get settings and data for easy access
-	rounding = int(settings["general_settings"]["rounding"])
-	verbose = settings["general_settings"]["verbose"]
-	modelNumber = int(settings["data_settings"]["model_number"])
-	model = MODEL_LIST[modelNumber]
-	modelSignature = [p.name for p in inspect.signature(model).parameters.values()]
+	# Settings for easy access
+	numStarts = settings["fit_settings"]["multistart"]
+	keep = settings["fit_settings"]["multistart_keep"]
+	seed = settings["fit_settings"]["seed"]
+	workers = settings["general_settings"]["workers"]
+	timer = writer.timer if writer is not None else lambda name: contextlib.nullcontext()
+
+	# Search from several starting points first if multi-start is enabled. 
+	# The fit below then starts from the best solution found. 
+	search = None
+	startParams = problem.initialParams
+	if numStarts > 0: 
+		with timer("multistart"): 
+			search = multiStart(problem, numStarts, keep, workers, seed)
+		startParams = search["best"].x
 
-	parameterData = [[t[0], t[1], t[2], t[3]] for t in data if t[0] in modelSignature]
-
-	# Generate prediction
-	formattedParams = unflattenParams(flatParams, paramIndex)
-	modelResult = model(*formattedParams) 
-
-	# Print table if in verbose mode
-	if verbose == "True" or verbose == "true": 
-		prediction = modelResult[-1]
-		# Replace initial data with optimal parameters 
-		for i, p in enumerate(formattedParams): 
-			parameterData[i][-1] = p 
-		# Draw table 
-		drawTable2Factor(parameterData, prediction, rounding)
-
-	# Format prediction
-	formattedPrediction = []
-	for m in modelResult:
-		if hasattr(m, "__len__"):
-			formattedPrediction.extend(m)
+	# We tweak parameters to minimize the difference between observed parameters + observed composite 
+	# and optimized parameters + model prediction 
+	# Use the model's analytic Jacobian if it has one, otherwise scipy estimates it with finite differences
+	with timer("fit"): 
+		if trace is None: 
+			result = solveProblem(problem, startParams)
 		else: 
-			formattedPrediction.append(m)
+			jac = getJacobian if hasattr(problem.model, "jacobian") else "2-point"
+			result = leastSquares(problem, getResiduals, startParams, jac, (problem, trace))
+	return result, search
 
-	# Get residuals
-	residuals = []
-	for i in range(len(allObserved)):
-		r = allObserved[i] - formattedPrediction[i] 
-		residuals.append(r)
+# Reports the final table (with optimal parameters) and the optimal parameters (rounded) to writer (or prints them). 
+# Also stores the model, optimal parameters, prediction and RMSD in the writer's result record. 
+def printFitResult(problem, optimalParams, writer = None):
 
-	rmsd = round(getRMSD(residuals), rounding)
-	print("RMSD = ", rmsd)
-	print()
+	rounding = problem.rounding
+	parameterData = [list(p) for p in problem.parameterData]
+	optimalPrediction = evaluateModel(problem.model, optimalParams)
 
+	# Replace initial data with optimal parameters 
+	for i, optimal in enumerate(optimalParams): 
+		parameterData[i][-1] = optimal
+
+	# Store the result 
+	flatParams, paramIndex = flattenParameters(*optimalParams)
+	residuals = problem.residuals(np.array(flatParams, dtype=float))
+	with useWriter(writer) as writer: 
+		writer.set(model = problem.model.__name__, parameters = getParameterValues(problem, optimalParams), 
+			prediction = optimalPrediction, rmsd = getRMSD(residuals))
+
+		# The tables below are only needed for the text report 
+		if not writer.wantsText: 
+			return
+
+		# Draw optimal table 
+		drawTableNFactor(parameterData, optimalPrediction, rounding, writer)
+		writer.write()
+
+		# Report optimal parameters (rounded)
+		writer.write("Optimal Parameters")
+		writer.write()
+		for p in parameterData:
+			values = p[-1]
+			if isinstance(values, list): 
+				for i, v in enumerate(values): 
+					values[i] = round(v, rounding)
+			else: 
+				values = round(values, rounding)
+			writer.write(p[1], values)
+
+# Returns the status, message and evaluation counts of a scipy result for the result record 
+def getSolverRecord(result): 
+	return {"status": int(result.status), "success": bool(result.success), "message": str(result.message), 
+		"evaluations": int(result.nfev), "jacobian_evaluations": None if result.njev is None else int(result.njev), 
+		"cost": float(result.cost)}
+
+# Returns the optimal parameters by parameter name (a list of values for a factor) 
+def getParameterValues(problem, optimalParams): 
+	return {p[0]: [float(v) for v in optimal] if isinstance(optimal, list) else float(optimal) 
+		for p, optimal in zip(problem.parameterData, optimalParams)}
+
+
+# Fits a problem from a starting point without printing. Returns the scipy result. 
+def solveProblem(problem, startParams):
+	jac = problem.jacobian if hasattr(problem.model, "jacobian") else "2-point"
+	return leastSquares(problem, problem.residuals, startParams, jac)
+
+# Runs scipy's least_squares on residuals (a function of the flat parameters and args) within the (0,1) bounds. 
+# If the problem is reparameterized (fit_settings reparameterize), the solver works on the logit of each parameter 
+# instead. That space has no bounds, so the faster Levenberg-Marquardt method (lm) is used, and an analytic 
+# Jacobian is converted with the chain rule. The returned result's x is always on the original (0,1) scale. 
+def leastSquares(problem, residuals, startParams, jac = "2-point", args = ()):
+	if not problem.reparameterize: 
+		result = least_squares(residuals, startParams, jac = jac, args = args, bounds=(0,1))
+		profiler.recordSolver(result)
+		return result
+
+	def logitResiduals(logits, *args): 
+		return residuals(fromLogit(logits), *args)
+
+	logitJacobian = jac
+	if callable(jac): 
+		def logitJacobian(logits, *args): 
+			params = fromLogit(logits)
+			return jac(params, *args) * (params * (1 - params))
+
+	result = least_squares(logitResiduals, toLogit(startParams), jac = logitJacobian, args = args, method = "lm")
+	result.x = fromLogit(result.x)
+	profiler.recordSolver(result)
+	return result
+
+# Returns the logit (log odds) of each parameter, the inverse of fromLogit. Parameters at 0 or 1 (such as observed 
+# values) are moved just inside (0,1) first. 
+def toLogit(params): 
+	params = np.clip(np.asarray(params, dtype=float), LOGIT_EDGE, 1 - LOGIT_EDGE)
+	return np.log(params) - np.log1p(-params)
+
+# Returns the parameters of logits (expit), kept just inside (0,1). expit rounds large logits to exactly 0 or 1, 
+# where some models are not defined (such as 0/0 in the FLMP). 
+def fromLogit(logits): 
+	return np.clip(expit(logits), LOGIT_EDGE, 1 - LOGIT_EDGE)
+
+# Compute residuals (actual - predicted) and record the RMSD in the fit trace
+@profiled
+def getResiduals(flatParams, problem, trace):
+	residuals = problem.residuals(flatParams)
+	trace.record(getRMSD(residuals), flatParams)
 	return residuals
 
+# Evaluates many parameter vectors (the rows of a (G, P) paramMatrix) without fitting. Rows are evaluated in 
+# chunks so that memory use stays bounded (about BATCH_MEMORY bytes at a time) however many rows there are. 
+# Returns the (G, N) residuals (None if keepResiduals is False, which keeps memory use bounded for large G) and 
+# the RMSD of each row. 
+def evaluateBatch(problem, paramMatrix, keepResiduals = True): 
+	paramMatrix = np.asarray(paramMatrix, dtype=float)
+	numRows = len(paramMatrix)
+	chunkSize = max(1, BATCH_MEMORY // (16 * len(problem.observed)))
+
+	residuals = np.empty((numRows, len(problem.observed))) if keepResiduals else None
+	rmsds = np.empty(numRows)
+	for start in range(0, numRows, chunkSize): 
+		chunk = problem.residualsBatch(paramMatrix[start:start + chunkSize])
+		rmsds[start:start + len(chunk)] = np.sqrt(np.einsum("ij,ij->i", chunk, chunk) / chunk.shape[1])
+		if keepResiduals: 
+			residuals[start:start + len(chunk)] = chunk
+	return residuals, rmsds
+
+# Computes the Jacobian of the residuals from the model's analytic Jacobian
+@profiled
+def getJacobian(flatParams, problem, trace):
+	return problem.jacobian(flatParams)
+
 # Gets the RMSD given a list of residuals
 def getRMSD(residuals):
-	rmsd = math.sqrt(sum([x**2 for x in residuals])/len(residuals))
+	residuals = np.asarray(residuals, dtype=float)
+	rmsd = math.sqrt(np.dot(residuals, residuals) / len(residuals))
 	return rmsd
 
 
+# Fit Trace #
+
+# Records the RMSD and parameters during a fit. 
+# Rows are stored in a NumPy buffer that doubles in size when full, and only every stride-th evaluation is kept. 
+class FitTrace:
+
+	def __init__(self, numParams, stride = 1, capacity = 64):
+		self.stride = max(1, int(stride))
+		self.evaluations = 0
+		self.size = 0
+		# Columns: evaluation number, RMSD, parameters 
+		self.buffer = np.empty((capacity, numParams + 2))
+
+	# Records one evaluation (only every stride-th evaluation is stored)
+	def record(self, rmsd, flatParams):
+		self.evaluations += 1
+		if (self.evaluations - 1) % self.stride != 0:
+			return
+		if self.size == len(self.buffer):
+			grown = np.empty((2 * len(self.buffer), self.buffer.shape[1]))
+			grown[:self.size] = self.buffer
+			self.buffer = grown
+		row = self.buffer[self.size]
+		row[0] = self.evaluations
+		row[1] = rmsd
+		row[2:] = flatParams
+		self.size += 1
+
+	# Returns the recorded rows (evaluation number, RMSD, parameters)
+	def rows(self):
+		return self.buffer[:self.size]
+
+	# Returns the trace as a dictionary of lists for the result record: evaluation numbers, RMSDs and (if 
+	# includeParameters is True) the parameters at each recorded evaluation 
+	def getRecord(self, includeParameters = False):
+		rows = self.rows()
+		record = {"evaluation": rows[:, 0].astype(int), "rmsd": rows[:, 1]}
+		if includeParameters: 
+			record["parameters"] = rows[:, 2:]
+		return record
+
+	# Returns the trace as a table. Parameter columns are included if parameter names are given. 
+	def formatTable(self, parameterNames = None, rounding = 5):
+		rows = self.rows()
+		columns = ["RMSD"]
+		values = rows[:, 1:2]
+		if parameterNames is not None:
+			columns = columns + list(parameterNames)
+			values = rows[:, 1:]
+		import pandas as pd
+		index = pd.Index(rows[:, 0].astype(int), name = "Evaluation")
+		return pd.DataFrame(np.round(values, rounding), index = index, columns = columns).to_string()
+
+	# Saves the trace to a .npz file (or a text table for other file names)
+	def save(self, filepath, parameterNames):
+		filepath = Path(filepath)
+		rows = self.rows()
+		if filepath.suffix == ".npz":
+			np.savez_compressed(filepath, evaluation = rows[:, 0].astype(int), rmsd = rows[:, 1], 
+				parameters = rows[:, 2:], names = np.array(parameterNames))
+		else:
+			with filepath.open("w") as f:
+				f.write(self.formatTable(parameterNames, 10) + "\n")
+
+
+# Multi-Start Functions #
+
+# Fits a problem from many starting points spread over the (0,1) bounds (Latin hypercube sample). 
+# The observed values are always included as one of the starts. Starts are screened by their initial cost 
+# and only the best fraction (keep) are fit. Fits run in parallel worker processes. 
+# Returns a dictionary with the best scipy result, its RMSD and how many starts converged to it. 
+def multiStart(problem, numStarts, keep = 0.5, workers = 0, seed = None):
+
+	# Draw starting points 
+	rng = np.random.default_rng(None if seed is None else int(seed))
+	starts = np.vstack((problem.initialParams, latinHypercube(numStarts, problem.numParams, rng)))
+
+	# Screen starts by their initial RMSD (all evaluated together) and keep the most promising ones 
+	residuals, rmsds = evaluateBatch(problem, starts, keepResiduals = False)
+	numKept = max(1, int(math.ceil(len(starts) * keep)))
+	kept = starts[np.argsort(rmsds, kind = "stable")[:numKept]]
+
+	# Fit each remaining start (in parallel if more than one worker is available)
+	results = mapWorkers(solveProblem, problem, kept, workers)
+
+	# Find the best fit and count how many starts reached it 
+	rmsds = np.array([getRMSD(r.fun) for r in results])
+	best = int(np.argmin(rmsds))
+	converged = int(np.sum(np.isclose(rmsds, rmsds[best], rtol = 1e-4, atol = 1e-8)))
+
+	return {"best": results[best], "bestRMSD": rmsds[best], "converged": converged, "solved": len(results), 
+		"screened": len(starts) - len(kept)}
+
+# Returns a Latin hypercube sample of points in (0,1). Each dimension is split into numPoints equal intervals 
+# and each interval is used exactly once. 
+def latinHypercube(numPoints, numDims, rng):
+	points = np.empty((numPoints, numDims))
+	for d in range(numDims): 
+		points[:, d] = (rng.permutation(numPoints) + rng.random(numPoints)) / numPoints
+	return points
+
+
+# Worker Pools #
+
+# Calls function(state, item) for each item and returns the results in order. With more than one worker, items are 
+# handled by a pool of worker processes and state (such as a problem and its optimal parameters) is sent once to 
+# each worker instead of once per item. function must be defined at the top level of a module so that it can be 
+# sent to the workers. If profiling is enabled, the profile of every item is added to this process's profiler. 
+def mapWorkers(function, state, items, workers = 0): 
+	items = list(items)
+	workers = min(getWorkerCount(workers), max(1, len(items)))
+	if workers == 1: 
+		return [function(state, item) for item in items]
+
+	results = []
+	chunksize = max(1, len(items) // (workers * 4))
+	with ProcessPoolExecutor(max_workers = workers, initializer = setWorkerState, 
+		initargs = (state, profiler.enabled)) as pool: 
+		for result, report in pool.map(functools.partial(callWorker, function), items, chunksize = chunksize): 
+			if report is not None: 
+				profiler.merge(report)
+			results.append(result)
+	return results
+
+# Worker process state (see mapWorkers) 
+workerState = None
+
+def setWorkerState(state, profile = False): 
+	global workerState
+	workerState = state
+	profiler.enable(profile)
+
+# Runs one item in a worker process. Returns its result and, if profiling is enabled, its profile. 
+def callWorker(function, item): 
+	profiler.reset()
+	result = function(workerState, item)
+	return result, profiler.report() if profiler.enabled else None
+
+
 # Drawing Functions #
 
 # Draws a display table for data (second parameter is fastest moving)
 # Columns are parameter 1, rows are parameter 2
-def drawTable2Factor(paramData, compositeData, rounding = 5):  
+# writer (optional): the ResultWriter to write the table to. By default the table is printed. 
+@profiled
+def drawTable2Factor(paramData, compositeData, rounding = 5, writer = None):  
+
+	write = print if writer is None else writer.write
+
+	# Imported here so that pandas is only loaded when a table is drawn
+	import pandas as pd
 
 	# Round parameter data (we can put this in a separate function later)
 	for p in paramData:
@@ -214,7 +665,7 @@ def drawTable2Factor(paramData, compositeData, rounding = 5):
 
 	# Combine rows into table 
 	groups.append(param1Data)
-	for i in range(0, param1Length):
+	for i in range(0, param2Length):
 		groups[i].append(param2Data[i])
 
 	# Make column and row labels
@@ -223,7 +674,7 @@ def drawTable2Factor(paramData, compositeData, rounding = 5):
 
 	# Output table and other params 
 	table = pd.DataFrame(groups, columns = colLabel, index = rowLabel)
-	print(table)
+	write(table)
 
 	for p in paramData[2:-1]:
 		values = p[-1]
@@ -232,86 +683,148 @@ def drawTable2Factor(paramData, compositeData, rounding = 5):
 				values[i] = round(v, rounding)
 		else: 
 			values = round(values, rounding)
-		print(p[1], values)
+		write(p[1], values)
 
-# Draws graph 
-# Observed values = points, predictions = lines
-def drawGraph2Factor(settings, observedParams, observedComposite, predictedParams, predictedComposite):
+# Draws a display table for any number of factors (first parameter is fastest moving). 
+# Designs with more than two factors are shown as one two factor table for each combination of levels of the 
+# other factors. Parameters that are not factors are written after the tables. 
+# writer (optional): the ResultWriter to write the tables to. By default the tables are printed. 
+def drawTableNFactor(paramData, compositeData, rounding = 5, writer = None): 
 
-	# Get settings 
-	modelNumber = int(settings["data_settings"]["model_number"])
-	model = MODEL_LIST[modelNumber]
+	factors = getFactors(paramData)
+	if len(factors) <= 2: 
+		return drawTable2Factor(paramData, compositeData, rounding, writer)
 
-	fileName = settings["graph_settings"]["graph_filename"]
-	caption = settings["graph_settings"]["graph_caption"]
-	xLabel = settings["graph_settings"]["graph_x_label"]
-	yLabel = settings["graph_settings"]["graph_y_label"]
-	legendLabel = settings["graph_settings"]["graph_legend_label"]
-
-	# Get parameter labels
-	P1Label = observedParams[0][1]
-	P1Abrv = observedParams[0][2]
+	write = print if writer is None else writer.write
+	for title, indexes in iterFactorSlices(factors): 
+		write(title)
+		sliceData = np.reshape(compositeData, getFactorShape(factors))[indexes]
+		drawTable2Factor([list(f) for f in factors[:2]], list(np.ravel(sliceData)), rounding, writer)
+		write()
 
-	P2Label = observedParams[1][1]
-	P2Abrv = observedParams[1][2]
+	for p in paramData: 
+		if not any(p is f for f in factors): 
+			write(p[1], round(p[-1], rounding))
 
-	# Get observed and predicted data 
-	observedP1Data = observedParams[0][3]
-	observedP2Data = observedParams[1][3]
+# Draws graph 
+# Observed values = points, predictions = lines
+# output (optional): a file or buffer to write the PNG to instead of the graph file in settings 
+# renderPool (optional): a RenderPool that draws the graph in another process (output must then be a path)
+@profiled
+def drawGraph2Factor(settings, observedParams, observedComposite, predictedParams, predictedComposite, output = None, renderPool = None):
+	job = makeGraph2FactorJob(settings, observedParams, observedComposite, predictedParams, predictedComposite)
+	return renderGraph(settings, job, output, renderPool)
 
-	predictedP1Data = predictedParams[0][3]
-	predictedP2Data = predictedParams[1][3]
+# Makes the render job for a two factor graph (see rendering.py)
+def makeGraph2FactorJob(settings, observedParams, observedComposite, predictedParams, predictedComposite):
 
-	# Get parameter and composite size 
-	param1Length = len(observedP1Data) 
-	param2Length = len(observedP2Data) 
-	compositeSize = param1Length * param2Length
+	# Get settings 
+	modelNumber = settings["data_settings"]["model_number"]
+	model = MODEL_LIST[modelNumber]
+	legendLabel = settings["graph_settings"]["graph_legend_label"]
 
 	# Graph label processing
 	if legendLabel == "" or legendLabel is None:
-		legendLabel = P2Label
-
-	# Set up Graph 
-	plt.figure(figsize=(12, 8))
-	plt.title(model.__name__)
-	plt.xlabel(xLabel)
-	plt.ylabel(yLabel)
-	plt.figtext(0.5, 0.01, caption + "\n", wrap=True, horizontalalignment='center', fontsize=10)
-
-	# Set line and point color scheme 
-	color_interval = np.linspace(0, 1, param1Length+1)
-	colors = [cm.plasma(x) for x in color_interval]
-
-	# Group data
-	# Note: this assumes that the first parameter is the "fastest moving" and that we will be graphing the first two parameters 
-	groups_observed = [observedComposite[-1][i:i+param1Length] for i in range(0, compositeSize, param1Length)]
-	groups_prediction = [predictedComposite[-1][i:i+param1Length] for i in range(0, compositeSize, param1Length)]
-
-	# Define x axis range (discrete)
-	xRange = [i for i in range(1, param1Length + 1)]
-
-	# Plot observed values (dots)
-	plt.scatter(xRange, observedP1Data, label = ('None'), marker = '.', s = 50, color = colors[0])
-	for i in range(len(observedP1Data)): 
-		plt.scatter(xRange, groups_observed[i],  label = (P2Abrv + str(i+1) +  ' = ' + str(round(observedP2Data[i],3))), marker = '.', s = 50, color = colors[i+1]) 
-
-	# Plot model prediction after optimization (lines)
-	plt.plot(xRange, predictedP1Data, color = colors[0])
-	for i in range(len(predictedP1Data)):
-		plt.plot(xRange, groups_prediction[i], color = colors[i + 1])
-
-	# Plot legend
-	plt.legend(loc="upper left", title=legendLabel, markerscale=1.5)
+		legendLabel = observedParams[1][1]
+
+	labels = {
+		"title": model.__name__,
+		"caption": settings["graph_settings"]["graph_caption"],
+		"x_label": settings["graph_settings"]["graph_x_label"],
+		"y_label": settings["graph_settings"]["graph_y_label"],
+		"legend_label": legendLabel,
+		"p2_abbreviation": observedParams[1][2],
+	}
+
+	# The first factor is on the x axis and each level of the second factor is a line 
+	observedFactors = getFactors(observedParams)
+	if len(observedFactors) <= 2: 
+		# Note: this assumes that we will be graphing the first two parameters 
+		return makeGraphJob(observedParams[0][3], observedParams[1][3], observedComposite[-1], predictedParams[0][3], 
+			predictedComposite[-1], labels)
+
+	# Designs with more than two factors get one panel for each combination of levels of the other factors 
+	predictedFactors = getFactors(predictedParams)
+	shape = getFactorShape(observedFactors)
+	observedGrid = np.reshape(observedComposite[-1], shape)
+	predictedGrid = np.reshape(predictedComposite[-1], shape)
+	panels = [(title, np.ravel(observedGrid[indexes]), np.ravel(predictedGrid[indexes])) 
+		for title, indexes in iterFactorSlices(observedFactors)]
+	return makeGraphJob(observedFactors[0][3], observedFactors[1][3], observedComposite[-1], predictedFactors[0][3], 
+		predictedComposite[-1], labels, panels)
+
+# Renders a graph job to output (or the graph file in settings), in this process or in a render pool 
+def renderGraph(settings, job, output = None, renderPool = None):
+
+	# Get output file 
+	if output is None: 
+		fileName = settings["graph_settings"]["graph_filename"]
+		if fileName is None or fileName == "": 
+			output = 'graphResult.png'
+		else:
+			output = resultsFolder / fileName
 
 	# Export image
-	if fileName is None or fileName == "": 
-		plt.savefig('graphResult.png')
-	else:
-		filePath = resultsFolder / fileName
-		plt.savefig(filePath)
+	if renderPool is not None: 
+		return renderPool.submit(job, output)
+	return renderGraph2Factor(job, output)
 
 # Helper Functions # 
 
+# Returns a model's prediction as a flat ndarray (in the same order as the composite data)
+# Vectorized models get NumPy arrays and return a prediction grid. Loop-style models are called with the 
+# original interface and the last returned value is used as the prediction. 
+def evaluateModel(model, params):
+	if getattr(model, "vectorized", False):
+		arrays = [np.asarray(p, dtype=float) for p in params]
+		return np.ravel(model(*arrays))
+	return np.asarray(model(*params)[-1], dtype=float)
+
+
+# Compares a model's analytic Jacobian against central finite differences
+# params: parameter values in the format passed to the model. Returns the largest absolute difference. 
+def checkJacobian(model, params, step = 1e-6):
+	flatParams, paramIndex = flattenParameters(*params)
+	flatParams = np.asarray(flatParams, dtype=float)
+	arrays = [np.asarray(p, dtype=float) for p in unflattenParams(flatParams, paramIndex)]
+	analytic = np.asarray(model.jacobian(*arrays), dtype=float)
+
+	numeric = np.empty_like(analytic)
+	for i in range(len(flatParams)):
+		upper = flatParams.copy()
+		lower = flatParams.copy()
+		upper[i] += step
+		lower[i] -= step
+		upperPrediction = evaluateModel(model, unflattenParams(upper, paramIndex))
+		lowerPrediction = evaluateModel(model, unflattenParams(lower, paramIndex))
+		numeric[:, i] = (upperPrediction - lowerPrediction) / (2 * step)
+
+	return np.max(np.abs(analytic - numeric))
+
+# Returns the parameters that are factors (parameters with more than one value), in model order 
+# paramData: a list of [name, label, abbreviation, values] for each parameter 
+def getFactors(paramData): 
+	return [p for p in paramData if isinstance(p[-1], (list, np.ndarray)) and len(p[-1]) > 1]
+
+# Returns the shape of the prediction grid of a design: the number of levels of each factor, last factor first 
+def getFactorShape(paramData): 
+	return tuple(len(f[-1]) for f in reversed(getFactors(paramData)))
+
+# Yields (title, indexes) for each combination of levels of the factors after the first two. indexes select 
+# the two factor slice of the prediction grid (see getFactorShape) and title describes the levels. 
+def iterFactorSlices(factors): 
+	extra = list(reversed(factors[2:]))
+	for indexes in np.ndindex(*[len(f[-1]) for f in extra]): 
+		levels = [f[2] + str(i + 1) + " = " + str(round(float(f[-1][i]), 3)) for f, i in zip(extra, indexes)]
+		yield ", ".join(reversed(levels)), indexes
+
+# Returns the number of worker processes to use (0 or less uses every CPU)
+def getWorkerCount(workers = 0):
+	workers = int(workers)
+	if workers <= 0:
+		workers = os.cpu_count() or 1
+	return workers
+
 # Returns the start and end index of each parameter
 def indexParams(*params):
 	# Determine size of each parameter group (how many of each kind)
@@ -3,9 +3,92 @@ models.py
 ''' 
 
 # Import tools 
-import pandas as pd
 import numpy as np
 
+# Model Tools #
+
+# Marks a model as vectorized. 
+# Vectorized models receive each parameter as a NumPy array (or a float for single-valued parameters) and 
+# return only the prediction grid as an ndarray. The grid is built by broadcasting, so the first parameter 
+# should be placed on the last axis (the "fastest moving" one). Index parameters with "..." (for example 
+# a[..., None, :]) so the model also works when parameters carry extra leading axes. 
+# Models without this decorator are called with the loop-style interface described in the README. 
+def vectorized(model):
+	model.vectorized = True
+	return model
+
+
+# Places each factor on its own axis of a prediction grid: the first factor on the last axis (fastest moving), 
+# the second factor on the axis before it, and so on. Extra leading axes of the parameters are kept. 
+# Returns the reshaped factors, which broadcast against each other to the full grid. 
+def factorGrid(*factors): 
+	count = len(factors)
+	grid = []
+	for i, factor in enumerate(factors): 
+		factor = np.asarray(factor)
+		grid.append(factor.reshape(factor.shape[:-1] + (1,) * (count - 1 - i) + factor.shape[-1:] + (1,) * i))
+	return grid
+
+# Attaches an analytic Jacobian to a model. 
+# The derivative function takes the same parameters as the model and returns a 2D array with one row per 
+# prediction (in composite order) and one column per parameter value (in the order the values are passed). 
+# Models without a Jacobian are fit using finite differences. 
+def jacobian(derivative):
+	def attach(model):
+		model.jacobian = derivative
+		return model
+	return attach
+
+# Marks the models that are special cases of this model (nested in it, for example this model with a parameter 
+# fixed). Compare mode runs a likelihood-ratio test for each pair of nested models. 
+def nests(*simplerModels):
+	def attach(model):
+		model.nests = list(simplerModels)
+		return model
+	return attach
+
+# Spreads the derivative of each prediction with respect to one factor into one column per factor level. 
+# grad is the derivative grid (same shape as the prediction) and axis is the factor's axis in that grid. 
+def factorColumns(grad, axis):
+	grad = np.asarray(grad, dtype=float)
+	axis = axis % grad.ndim
+	levels = grad.shape[axis]
+	shape = [1] * grad.ndim + [levels]
+	shape[axis] = levels
+	identity = np.eye(levels).reshape(shape)
+	return (grad[..., None] * identity).reshape(-1, levels)
+
+
+# Define model Jacobians here. 
+
+def flmpJacobian(a_params, v_params):
+	a = a_params[None, :]
+	v = v_params[:, None]
+	support = a * v
+	denominator = (support + ((1 - a) * (1 - v))) ** 2
+	gradA = (v * (1 - v)) / denominator
+	gradV = (a * (1 - a)) / denominator
+	return np.hstack((factorColumns(gradA, -1), factorColumns(gradV, -2)))
+
+def scJacobian(a_params, v_params, bias):
+	a = a_params[None, :]
+	v = v_params[:, None]
+	gradA = np.full((len(v_params), len(a_params)), bias)
+	gradV = np.full((len(v_params), len(a_params)), 1 - bias)
+	gradBias = (a - v).reshape(-1, 1)
+	return np.hstack((factorColumns(gradA, -1), factorColumns(gradV, -2), gradBias))
+
+def flmp3Jacobian(a_params, v_params, c_params):
+	a, v, c = factorGrid(a_params, v_params, c_params)
+	support = a * v * c
+	denominator = (support + ((1 - a) * (1 - v) * (1 - c))) ** 2
+	shape = denominator.shape
+	gradA = np.broadcast_to(v * c * (1 - v) * (1 - c) / denominator, shape)
+	gradV = np.broadcast_to(a * c * (1 - a) * (1 - c) / denominator, shape)
+	gradC = np.broadcast_to(a * v * (1 - a) * (1 - v) / denominator, shape)
+	return np.hstack((factorColumns(gradA, -1), factorColumns(gradV, -2), factorColumns(gradC, -3)))
+
+
 # Define models to test here.
 
 def exampleModel(parameter1, parameter2): 
@@ -16,29 +99,38 @@ def exampleModel(parameter1, parameter2):
             prediction.append(value)    
     return parameter1, parameter2, prediction 
 
+@vectorized
+@jacobian(flmpJacobian)
 def flmpModel(a_params, v_params):
-	predicted_values = []
-	for v in v_params:
-		for a in a_params:
-			value = (a*v) / ((a*v) + ((1-a) * (1-v)))
-			predicted_values.append(value)	
-	return a_params, v_params, predicted_values
+	a = a_params[..., None, :]
+	v = v_params[..., :, None]
+	support = a * v
+	return support / (support + ((1 - a) * (1 - v)))
 
 
+@vectorized
+@jacobian(scJacobian)
 def scModel(a_params, v_params, bias): 
-	predicted_values = []
-	for v in v_params:
-		for a in a_params:
-			value = (a*bias) + (v*(1-bias))
-			predicted_values.append(value)	
-	return a_params, v_params, bias, predicted_values
+	a = a_params[..., None, :]
+	v = v_params[..., :, None]
+	return (a * bias) + (v * (1 - bias))
+
+
+# Three factor FLMP (for example auditory x visual x context). The prediction grid has the axes (c, v, a). 
+@vectorized
+@jacobian(flmp3Jacobian)
+def flmp3Model(a_params, v_params, c_params):
+	a, v, c = factorGrid(a_params, v_params, c_params)
+	support = a * v * c
+	return support / (support + ((1 - a) * (1 - v) * (1 - c)))
 
 
 # A list of all models  
-MODEL_LIST = [exampleModel, flmpModel, scModel] 
+MODEL_LIST = [exampleModel, flmpModel, scModel, flmp3Model] 
 
 '''
 NOTES 
 The first parameter should be "fastest moving". In general, parameters should go in this order in 
-relation to the composite data. See README for more information. 
+relation to the composite data. This holds for any number of factors: the composite data is the prediction 
+grid (last factor on the first axis, first factor on the last axis) read row by row. See README for more information. 
 '''
@@ -0,0 +1,58 @@
+'''
+profilecheck.py
+Checks that profile likelihood intervals (fit_settings likelihood_profile) do not depend on the grid size. Run from
+the ProgramFiles directory:
+
+	python3 profilecheck.py [--points 21] [--reference 201] [--tolerance 1e-3]
+
+Fits the example data files (rdata.json with the FLMP and exampledata3factor.json with the three factor FLMP) and
+profiles every parameter on a coarse grid (points values, as suggested in the README) and on a fine reference grid.
+Fails if an end of any interval differs between the two by more than the tolerance.
+'''
+
+# Imports #
+
+import sys
+import argparse
+import numpy as np
+
+from likelihoodprofile import *
+from benchmark import makeBenchmarkSettings
+
+# Data files and the models they are fit with
+CHECK_DATA = [("rdata.json", 1), ("exampledata3factor.json", 3)]
+
+# Check Functions #
+
+# Profiles every parameter of a model fit to a data file with points and referencePoints grid values
+# Returns the parameter names and the (lower, upper) intervals of both grids
+def checkProfile(dataFileName, modelNumber, points = 21, referencePoints = 201, confidence = 0.95):
+	settings = makeBenchmarkSettings(modelNumber)
+	problem, optimalParams, result = solveModel(settings, getDataFromFile(dataFolder / dataFileName))
+	optimal = np.array(flattenParameters(*optimalParams)[0], dtype=float)
+	threshold = getThreshold(getSSE(problem, optimal), len(problem.observed), confidence)
+
+	grid, profiles, intervals = profileParameters(problem, optimal, points, threshold, 1)
+	grid, profiles, reference = profileParameters(problem, optimal, referencePoints, threshold, 1)
+	return problem.parameterNames(), intervals, reference
+
+
+# RUN MAIN #
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Check that profile likelihood intervals do not depend on the grid size.")
+	parser.add_argument("--points", type = int, default = 21, help = "grid values per parameter (default 21)")
+	parser.add_argument("--reference", type = int, default = 201, help = "grid values of the reference profile (default 201)")
+	parser.add_argument("--tolerance", type = float, default = 1e-3, help = "largest allowed difference of an interval end (default 1e-3)")
+	args = parser.parse_args()
+
+	failed = False
+	for dataFileName, modelNumber in CHECK_DATA:
+		names, intervals, reference = checkProfile(dataFileName, modelNumber, args.points, args.reference)
+		difference = float(np.max(np.abs(np.subtract(intervals, reference))))
+		print(MODEL_LIST[modelNumber].__name__.ljust(12), dataFileName.ljust(24), "largest interval difference", "%.2e" % difference)
+		for name, interval, fine in zip(names, intervals, reference):
+			if np.max(np.abs(np.subtract(interval, fine))) > args.tolerance:
+				print("FAIL:", name, "interval", [round(v, 5) for v in interval], "differs from", [round(v, 5) for v in fine])
+				failed = True
+	sys.exit(1 if failed else 0)
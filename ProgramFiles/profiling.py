@@ -0,0 +1,117 @@
+'''
+profiling.py
+Measures where the time of a run goes. While profiling is enabled (general_settings profile), every function
+marked with @profiled records how many times it was called and its total wall time, and every solver result
+passed to recordSolver adds its evaluation counts and status. When profiling is disabled a profiled function
+only checks one flag before it is called, so the markers can stay on functions that are called many times
+per fit (such as getResiduals).
+
+Times are inclusive: the time of fitModel includes the time of the getResiduals calls made during the fit.
+Each process has its own profiler; batch mode and mapWorkers (modelfitting.py) merge the reports of their worker
+processes (see merge).
+'''
+
+# Imports #
+
+import time
+import json
+import functools
+
+# Profiler #
+
+# Call counts, wall times and solver counters of the current process
+class Profiler:
+
+	def __init__(self):
+		self.enabled = False
+		self.reset()
+
+	# Clears every recorded value (does not change whether profiling is enabled)
+	def reset(self):
+		self.phases = {}
+		self.solver = {"solves": 0, "evaluations": 0, "jacobian_evaluations": 0, "statuses": {}}
+
+	# Turns profiling on or off
+	def enable(self, enabled = True):
+		self.enabled = enabled
+
+	# Adds calls and their total time (in seconds) to a phase
+	def addPhase(self, name, seconds, calls = 1):
+		phase = self.phases.get(name)
+		if phase is None:
+			phase = self.phases[name] = {"calls": 0, "seconds": 0.0}
+		phase["calls"] += calls
+		phase["seconds"] += seconds
+
+	# Adds the counters of a scipy least_squares result: function evaluations (nfev), Jacobian evaluations (njev)
+	# and the number of solves that ended with each status
+	def recordSolver(self, result):
+		if not self.enabled:
+			return
+		self.solver["solves"] += 1
+		self.solver["evaluations"] += int(result.nfev)
+		if result.njev is not None:
+			self.solver["jacobian_evaluations"] += int(result.njev)
+		status = str(int(result.status))
+		self.solver["statuses"][status] = self.solver["statuses"].get(status, 0) + 1
+
+	# Returns everything recorded as a dictionary that can be written as JSON
+	def report(self):
+		return {
+			"phases": {name: dict(phase) for name, phase in self.phases.items()},
+			"solver": dict(self.solver, statuses = dict(self.solver["statuses"])),
+		}
+
+	# Adds a report from another profiler (such as a worker process) to this one
+	def merge(self, report):
+		for name, phase in report["phases"].items():
+			self.addPhase(name, phase["seconds"], phase["calls"])
+		solver = report["solver"]
+		for counter in ["solves", "evaluations", "jacobian_evaluations"]:
+			self.solver[counter] += solver[counter]
+		for status, count in solver["statuses"].items():
+			self.solver["statuses"][status] = self.solver["statuses"].get(status, 0) + count
+
+	# Returns the report as a readable block of text
+	def formatSummary(self):
+		lines = ["Profile", ""]
+		if len(self.phases) > 0:
+			width = max(len(name) for name in self.phases)
+			lines.append("Phase".ljust(width) + "  " + "Calls".rjust(8) + "  " + "Seconds".rjust(10) + "  " + "Per call (ms)".rjust(13))
+			for name, phase in self.phases.items():
+				perCall = phase["seconds"] / phase["calls"] * 1000 if phase["calls"] > 0 else 0
+				lines.append(name.ljust(width) + "  " + str(phase["calls"]).rjust(8) + "  " +
+					("%.4f" % phase["seconds"]).rjust(10) + "  " + ("%.3f" % perCall).rjust(13))
+			lines.append("")
+		solver = self.solver
+		statuses = ", ".join("status " + status + ": " + str(count) for status, count in sorted(solver["statuses"].items()))
+		lines.append("Solver: " + str(solver["solves"]) + " solves, " + str(solver["evaluations"]) + " function evaluations, "
+			+ str(solver["jacobian_evaluations"]) + " Jacobian evaluations" + (" (" + statuses + ")" if statuses != "" else ""))
+		return "\n".join(lines)
+
+	# Writes the report to a JSON file
+	def save(self, filepath):
+		with open(filepath, "w") as f:
+			json.dump(self.report(), f, indent = 1)
+
+# The profiler of this process
+profiler = Profiler()
+
+
+# Helper Functions #
+
+# Marks a function to be profiled under its own name (see Profiler)
+def profiled(function):
+	name = function.__name__
+
+	@functools.wraps(function)
+	def wrapper(*args, **kwargs):
+		if not profiler.enabled:
+			return function(*args, **kwargs)
+		start = time.perf_counter()
+		try:
+			return function(*args, **kwargs)
+		finally:
+			profiler.addPhase(name, time.perf_counter() - start)
+
+	return wrapper
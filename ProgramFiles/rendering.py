@@ -0,0 +1,205 @@
+'''
+rendering.py
+Draws graphs without pyplot's global state. Each graph is described by a render job (a dictionary of the
+observed and predicted data plus labels) so that it can be drawn in the current process or handed to a
+pool of render processes while fitting continues.
+'''
+
+# Imports #
+
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from profiling import *
+
+# Render Jobs #
+
+# Makes a render job for a two factor graph
+# observedP1, observedP2, predictedP1: parameter values. observedComposite, predictedComposite: composite values
+# (first parameter fastest moving). labels: a dictionary with title, caption, x_label, y_label, legend_label,
+# p2_abbreviation.
+# panels (optional): for designs with more than two factors, a list of (title, observed composite, predicted
+# composite) for each two factor slice. Each slice is drawn in its own panel.
+def makeGraphJob(observedP1, observedP2, observedComposite, predictedP1, predictedComposite, labels, panels = None):
+	job = {
+		"observed_p1": [float(v) for v in observedP1],
+		"observed_p2": [float(v) for v in observedP2],
+		"observed_composite": [float(v) for v in observedComposite],
+		"predicted_p1": [float(v) for v in predictedP1],
+		"predicted_composite": [float(v) for v in predictedComposite],
+		"labels": dict(labels),
+	}
+	if panels is not None:
+		job["panels"] = [{"title": title, "observed_composite": [float(v) for v in observed],
+			"predicted_composite": [float(v) for v in predicted]} for title, observed, predicted in panels]
+	return job
+
+# Draws a two factor graph and saves it as a PNG. Observed values = points, predictions = lines.
+# Jobs with panels (designs with more than two factors) draw one two factor graph per panel in a grid.
+# output: a file path or a writable buffer
+@profiled
+def renderGraph2Factor(job, output):
+
+	# Imported here so that matplotlib is only loaded when a graph is drawn. The Agg canvas is used directly,
+	# so no window or pyplot figure is ever created and the figure is freed once this function returns.
+	from matplotlib.figure import Figure
+	from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+	labels = job["labels"]
+	panels = job.get("panels")
+
+	# Set up Graph
+	if panels is None:
+		figure = Figure(figsize=(12, 8))
+		FigureCanvasAgg(figure)
+		axes = figure.add_subplot()
+		axes.set_title(labels["title"])
+		axes.set_xlabel(labels["x_label"])
+		axes.set_ylabel(labels["y_label"])
+		plotFactorPanel(axes, job, job["observed_composite"], job["predicted_composite"], legend = True)
+	else:
+		columns = int(np.ceil(np.sqrt(len(panels))))
+		rows = int(np.ceil(len(panels) / columns))
+		figure = Figure(figsize=(max(12, 6 * columns), max(8, 4.5 * rows)))
+		FigureCanvasAgg(figure)
+		figure.suptitle(labels["title"])
+		figure.supxlabel(labels["x_label"])
+		figure.supylabel(labels["y_label"])
+		grid = figure.subplots(rows, columns, squeeze = False, sharey = True)
+		for i, axes in enumerate(grid.flat):
+			if i >= len(panels):
+				axes.set_visible(False)
+				continue
+			axes.set_title(panels[i]["title"])
+			plotFactorPanel(axes, job, panels[i]["observed_composite"], panels[i]["predicted_composite"], legend = i == 0)
+	figure.text(0.5, 0.01, labels["caption"] + "\n", wrap=True, horizontalalignment='center', fontsize=10)
+
+	# Export image
+	return saveFigure(figure, output)
+
+# Plots observed values (points) and predictions (lines) of a two factor design on axes. The first factor is on
+# the x axis and each level of the second factor is a line. 
+def plotFactorPanel(axes, job, observedComposite, predictedComposite, legend = True):
+
+	from matplotlib import cm
+
+	labels = job["labels"]
+	observedP1Data = job["observed_p1"]
+	observedP2Data = job["observed_p2"]
+	predictedP1Data = job["predicted_p1"]
+
+	# Get parameter and composite size
+	param1Length = len(observedP1Data)
+	param2Length = len(observedP2Data)
+	compositeSize = param1Length * param2Length
+
+	# Set line and point color scheme
+	color_interval = np.linspace(0, 1, param2Length+1)
+	colors = [cm.plasma(x) for x in color_interval]
+
+	# Group data
+	# Note: this assumes that the first parameter is the "fastest moving"
+	groups_observed = [observedComposite[i:i+param1Length] for i in range(0, compositeSize, param1Length)]
+	groups_prediction = [predictedComposite[i:i+param1Length] for i in range(0, compositeSize, param1Length)]
+
+	# Define x axis range (discrete)
+	xRange = [i for i in range(1, param1Length + 1)]
+
+	# Plot observed values (dots)
+	p2Abrv = labels["p2_abbreviation"]
+	axes.scatter(xRange, observedP1Data, label = ('None'), marker = '.', s = 50, color = colors[0])
+	for i in range(param2Length):
+		axes.scatter(xRange, groups_observed[i], label = (p2Abrv + str(i+1) + ' = ' + str(round(observedP2Data[i],3))), marker = '.', s = 50, color = colors[i+1])
+
+	# Plot model prediction after optimization (lines)
+	axes.plot(xRange, predictedP1Data, color = colors[0])
+	for i in range(param2Length):
+		axes.plot(xRange, groups_prediction[i], color = colors[i + 1])
+
+	# Plot legend
+	if legend:
+		axes.legend(loc="upper left", title=labels["legend_label"], markerscale=1.5)
+
+
+# Draws a fit landscape (the RMSD over one or two parameters, see landscape.py) and saves it as a PNG.
+# One parameter gives a line; two parameters give a heatmap. The optimal parameters are marked.
+# job: a dictionary with title, names (one or two parameter names), values (the grid of each parameter), rmsd
+# (a list, or a list of rows for two parameters, one row per value of the second parameter) and optimal (the
+# optimal value of each parameter). output: a file path or a writable buffer
+@profiled
+def renderLandscape(job, output):
+
+	from matplotlib.figure import Figure
+	from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+	figure = Figure(figsize=(10, 8))
+	FigureCanvasAgg(figure)
+	axes = figure.add_subplot()
+	axes.set_title(job["title"])
+	names = job["names"]
+	values = job["values"]
+	rmsd = np.asarray(job["rmsd"])
+
+	if len(names) == 1:
+		axes.plot(values[0], rmsd, color = "black")
+		axes.axvline(job["optimal"][0], color = "red", linestyle = "--", label = "Optimum")
+		axes.set_xlabel(names[0])
+		axes.set_ylabel("RMSD")
+		axes.legend(loc = "upper left")
+	else:
+		mesh = axes.pcolormesh(values[0], values[1], rmsd, cmap = "viridis", shading = "auto")
+		axes.contour(values[0], values[1], rmsd, levels = 10, colors = "white", linewidths = 0.5)
+		axes.plot(job["optimal"][0], job["optimal"][1], marker = "x", color = "red", markersize = 10, linestyle = "",
+			label = "Optimum")
+		figure.colorbar(mesh, ax = axes, label = "RMSD")
+		axes.set_xlabel(names[0])
+		axes.set_ylabel(names[1])
+		axes.legend(loc = "upper left")
+
+	return saveFigure(figure, output)
+
+# Saves a figure as a PNG. output: a file path or a writable buffer. As with plt.savefig, a file path without an
+# extension gets .png added. Returns the path (or buffer) that was written.
+def saveFigure(figure, output):
+	if not isinstance(output, (str, os.PathLike)):
+		figure.savefig(output, format = "png")
+		return output
+	if os.path.splitext(output)[1] == "":
+		output = type(output)(str(output) + ".png")
+	figure.savefig(output)
+	return output
+
+
+# Render Pool #
+
+# Renders graphs in separate processes. submit() returns immediately, so the caller does not wait for drawing
+# and PNG encoding. Use as a context manager; leaving the block waits for all graphs to be saved.
+class RenderPool:
+
+	def __init__(self, workers = 1):
+		self.executor = ProcessPoolExecutor(max_workers = max(1, int(workers)))
+		self.futures = []
+
+	# Queues a render job. Returns a future that resolves to the output path.
+	def submit(self, job, outputPath):
+		future = self.executor.submit(renderGraph2Factor, job, str(outputPath))
+		self.futures.append((future, str(outputPath)))
+		return future
+
+	# Waits for all queued graphs. Returns a list of (output path, error message) for graphs that failed.
+	def close(self):
+		failed = []
+		for future, outputPath in self.futures:
+			error = future.exception()
+			if error is not None:
+				failed.append((outputPath, type(error).__name__ + " " + str(error)))
+		self.executor.shutdown(wait = True)
+		self.futures = []
+		return failed
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
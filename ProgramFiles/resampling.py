@@ -0,0 +1,108 @@
+'''
+resampling.py
+Estimates parameter uncertainty by refitting resampled data (bootstrap).
+'''
+
+# Imports #
+
+import numpy as np
+
+from modelfitting import *
+
+# Main Interface #
+
+# Runs the bootstrap for a fitted model and reports a confidence interval for each parameter
+# optimalParams: the parameters returned by fitModel
+# writer (optional): the ResultWriter that the intervals are reported to. By default they are printed. 
+def runBootstrap(settings, data, optimalParams, writer = None):
+
+	# Settings for easy access
+	numReplicates = settings["fit_settings"]["bootstrap"]
+	method = settings["fit_settings"]["bootstrap_method"]
+	confidence = settings["fit_settings"]["confidence"]
+	seed = settings["fit_settings"]["seed"]
+	workers = settings["general_settings"]["workers"]
+
+	problem = FitProblem(settings, data)
+	flatParams, paramIndex = flattenParameters(*optimalParams)
+	optimal = np.array(flatParams, dtype=float)
+
+	# Use a random seed if none is given, and print it so that the run can be repeated
+	seedSequence = np.random.SeedSequence(None if seed is None else int(seed))
+
+	with useWriter(writer) as writer:
+		with writer.timer("bootstrap"):
+			replicates = bootstrap(problem, optimal, numReplicates, method, seedSequence, workers)
+		lower, upper = percentileIntervals(replicates, confidence)
+
+		# Report intervals
+		rounding = problem.rounding
+		names = problem.parameterNames()
+		writer.set(bootstrap = {"replicates": numReplicates, "method": method, "confidence": confidence,
+			"seed": seedSequence.entropy, "intervals": {name: [low, high] for name, low, high in zip(names, lower, upper)}})
+		writer.write()
+		writer.write("Bootstrap Confidence Intervals")
+		writer.write()
+		writer.write(str(round(confidence * 100, 2)) + "% percentile intervals from " + str(numReplicates) + " replicates ("
+			+ method + ", seed " + str(seedSequence.entropy) + ")")
+		writer.write()
+		for name, estimate, low, high in zip(names, optimal, lower, upper):
+			writer.write(name, round(estimate, rounding), "[" + str(round(low, rounding)) + ", " + str(round(high, rounding)) + "]")
+
+	return lower, upper
+
+
+# Bootstrap Functions #
+
+# Refits the problem to resampled data numReplicates times. Returns a (replicates, parameters) array.
+# method: "residuals" adds resampled residuals to the fitted values. "cells" resamples the observed values
+# (parameter and composite cells) with replacement.
+# Each replicate uses its own random stream (spawned from seedSequence), so results do not depend on the
+# number of workers. Every refit starts from the optimal parameters.
+def bootstrap(problem, optimal, numReplicates, method = "residuals", seedSequence = None, workers = 0):
+
+	if method not in ["residuals", "cells"]:
+		raise ValueError("Unknown bootstrap method " + str(method) + ". Use residuals or cells.")
+	if seedSequence is None:
+		seedSequence = np.random.SeedSequence()
+
+	streams = seedSequence.spawn(numReplicates)
+
+	replicates = mapWorkers(fitReplicate, (problem, optimal, method), streams, workers)
+	return np.array(replicates)
+
+# Returns the lower and upper percentile interval of each column of replicates
+def percentileIntervals(replicates, confidence = 0.95):
+	alpha = (1 - confidence) / 2
+	lower, upper = np.percentile(replicates, [alpha * 100, (1 - alpha) * 100], axis = 0)
+	return lower, upper
+
+# Makes a resampled problem. Parameter values and composite values are resampled separately
+# because they are different kinds of data.
+def resampleProblem(problem, optimal, method, rng):
+
+	blocks = [slice(0, problem.numParams), slice(problem.numParams, len(problem.observed))]
+
+	if method == "residuals":
+		residuals = problem.residuals(optimal)
+		fitted = problem.observed - residuals
+		observed = fitted.copy()
+		for b in blocks:
+			observed[b] += rng.choice(residuals[b], size = len(residuals[b]), replace = True)
+		return problem.withObserved(np.clip(observed, 0, 1))
+
+	# Cells: count how many times each value is drawn and weight its residual by that count
+	weights = np.zeros(len(problem.observed))
+	for b in blocks:
+		size = b.stop - b.start
+		weights[b] = rng.multinomial(size, np.full(size, 1 / size))
+	return problem.withObserved(problem.observed, weights)
+
+
+# Refits one resampled problem (using the random stream) from the optimal parameters. Returns its parameters.
+# state: the problem, its optimal parameters and the bootstrap method (see mapWorkers in modelfitting.py).
+def fitReplicate(state, stream):
+	problem, optimal, method = state
+	rng = np.random.default_rng(stream)
+	replicate = resampleProblem(problem, optimal, method, rng)
+	return solveProblem(replicate, optimal).x
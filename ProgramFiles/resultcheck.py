@@ -0,0 +1,80 @@
+'''
+resultcheck.py
+Checks that a run that fails does not write an "ok" result to the jsonl and csv result files (general_settings
+result_format). Run from the ProgramFiles directory:
+
+	python3 resultcheck.py
+
+Runs the program in automatic mode with a data file that does not match the model (the program prints an error and
+exits), and fails a result writer with an exception. Fails if either one writes a result with the status "ok".
+The result files are written to the UserResults folder as resultcheck.* and removed afterwards.
+'''
+
+# Imports #
+
+import io
+import sys
+import csv
+import json
+import contextlib
+
+from commandline import *
+
+# Name of the result files written by the check (in UserResults)
+CHECK_NAME = "resultcheck"
+
+# Check Functions #
+
+# Returns the status of every result in the jsonl and csv result files of CHECK_NAME
+def readStatuses():
+	statuses = []
+	with open(resultsFolder / (CHECK_NAME + ".jsonl")) as f:
+		statuses += [json.loads(line)["status"] for line in f if line.strip() != ""]
+	with open(resultsFolder / (CHECK_NAME + ".csv"), newline = "") as f:
+		statuses += [row["status"] for row in csv.DictReader(f)]
+	return statuses
+
+# Removes the result files of CHECK_NAME
+def removeResults():
+	for suffix in ["", ".jsonl", ".csv"]:
+		(resultsFolder / (CHECK_NAME + suffix)).unlink(missing_ok = True)
+
+# Runs the program on data that the model cannot be fit to. Returns the statuses written to the result files.
+def checkFailedRun():
+	removeResults()
+	settings = loadSettings(userSettingsFile, defaultSettingsFile, {}, ["interactive=false", "data_filename=rdata.json",
+		"model_number=0", "result_format=text,jsonl,csv", "result_filename=" + CHECK_NAME, "cache=false"])
+	with contextlib.redirect_stdout(io.StringIO()):
+		try:
+			runAll(settings, drawGraph = False)
+		except SystemExit:
+			pass
+	statuses = readStatuses()
+	removeResults()
+	return statuses
+
+# Fails a result writer with an exception. Returns the statuses written to the result files.
+def checkException():
+	removeResults()
+	try:
+		with makeResultWriter(["jsonl", "csv"], resultsFolder / CHECK_NAME) as writer:
+			writer.set(data_file = "none")
+			raise ValueError("check")
+	except ValueError:
+		pass
+	statuses = readStatuses()
+	removeResults()
+	return statuses
+
+
+# RUN MAIN #
+
+if __name__ == "__main__":
+	failed = False
+	for name, check in [("failed run", checkFailedRun), ("exception", checkException)]:
+		statuses = check()
+		print(name.ljust(12), "statuses:", statuses)
+		if len(statuses) == 0 or "ok" in statuses:
+			print("FAIL:", name, "wrote an \"ok\" result (or none)")
+			failed = True
+	sys.exit(1 if failed else 0)
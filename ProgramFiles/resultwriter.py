@@ -0,0 +1,201 @@
+'''
+resultwriter.py
+Collects the result of one fit (parameters, prediction, RMSD, solver status, timings and the human readable
+report) and writes it to one or more sinks: a text report, a JSON Lines log or a CSV table. Each fit job gets its
+own writer, so fits in different threads never share output. Nothing is written until the writer is closed.
+'''
+
+# Imports #
+
+import io
+import os
+import sys
+import csv
+import json
+import time
+import threading
+import contextlib
+from pathlib import Path
+
+# Globals #
+
+# Result formats (general_settings result_format) and the file suffix each one adds to result_filename
+RESULT_FORMATS = {"text": "", "jsonl": ".jsonl", "csv": ".csv"}
+
+# Columns of the CSV sink. Nested values (parameters, solver) are written as JSON.
+CSV_COLUMNS = ["data_file", "model", "status", "rmsd", "parameters", "solver", "timings"]
+
+# One lock per output file so that writers in different threads append whole records
+fileLocks = {}
+fileLocksLock = threading.Lock()
+
+# Result Writer #
+
+# Collects the result of one fit. Code that reports results calls write() (like print) for the text report and
+# set() for structured values. Use as a context manager; leaving the block writes the result to every sink.
+# wantsText: whether the text report is used (by default, if a sink writes it). Code that builds tables for the
+# report skips them when it is False, and only stores structured values.
+class ResultWriter:
+
+	def __init__(self, sinks = None, wantsText = None):
+		self.sinks = list(sinks) if sinks is not None else []
+		self.wantsText = any(isinstance(s, TextSink) for s in self.sinks) if wantsText is None else wantsText
+		self.text = io.StringIO()
+		self.record = {"status": "ok", "timings": {}}
+		self.start = time.perf_counter()
+		self.closed = False
+
+	# Adds a line to the text report (same arguments as print)
+	def write(self, *values, sep = " ", end = "\n"):
+		self.text.write(sep.join(str(v) for v in values) + end)
+
+	# Stores structured values in the result record
+	def set(self, **values):
+		self.record.update(values)
+
+	# Times a block and adds its duration (in seconds) to the timings of the result record
+	@contextlib.contextmanager
+	def timer(self, name):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			timings = self.record["timings"]
+			timings[name] = timings.get(name, 0) + time.perf_counter() - start
+
+	# Returns the text report
+	def getText(self):
+		return self.text.getvalue()
+
+	# Writes the result to every sink (only once)
+	def close(self):
+		if self.closed:
+			return
+		self.closed = True
+		self.record["timings"]["total"] = time.perf_counter() - self.start
+		for sink in self.sinks:
+			sink.write(self)
+
+	def __enter__(self):
+		return self
+
+	# A run that stops with an exception (or sys.exit with an error status) is recorded as an error, not "ok"
+	def __exit__(self, errorType, error, traceback):
+		if errorType is not None and not (errorType is SystemExit and error.code in [None, 0]):
+			self.set(status = "error: " + describeError(error))
+		self.close()
+
+
+# Sinks #
+
+# Writes the text report to a file (replacing it) or to a stream such as sys.stdout
+class TextSink:
+
+	def __init__(self, output):
+		self.output = output
+
+	def write(self, writer):
+		if isinstance(self.output, (str, Path)):
+			with getFileLock(self.output), open(self.output, "w") as f:
+				f.write(writer.getText())
+		else:
+			self.output.write(writer.getText())
+			self.output.flush()
+
+# Appends the result record to a JSON Lines file (one line per fit)
+class JSONLinesSink:
+
+	def __init__(self, filepath):
+		self.filepath = filepath
+
+	def write(self, writer):
+		appendToFile(self.filepath, json.dumps(toJSON(writer.record)) + "\n")
+
+# Appends the result record to a CSV file (one row per fit). The header is written when the file is new.
+class CSVSink:
+
+	def __init__(self, filepath):
+		self.filepath = filepath
+
+	def write(self, writer):
+		record = toJSON(writer.record)
+		row = {}
+		for column in CSV_COLUMNS:
+			value = record.get(column, "")
+			row[column] = json.dumps(value) if isinstance(value, (dict, list)) else value
+
+		buffer = io.StringIO()
+		csvWriter = csv.DictWriter(buffer, fieldnames = CSV_COLUMNS)
+		csvWriter.writerow(row)
+		appendToFile(self.filepath, buffer.getvalue(), header = ",".join(CSV_COLUMNS) + "\r\n")
+
+
+# Helper Functions #
+
+# Makes the writer for a fit from the result_format setting (a comma separated list of RESULT_FORMATS).
+# Every format writes to resultFilePath plus the format's suffix.
+def makeResultWriter(formats, resultFilePath):
+	sinks = []
+	for name in formats:
+		path = str(resultFilePath) + RESULT_FORMATS[name]
+		if name == "text":
+			sinks.append(TextSink(path))
+		elif name == "jsonl":
+			sinks.append(JSONLinesSink(path))
+		else:
+			sinks.append(CSVSink(path))
+	return ResultWriter(sinks)
+
+# Reads a result_format setting. Returns a list of format names, or None if a name is not in RESULT_FORMATS.
+def parseResultFormats(text):
+	formats = [f.strip().lower() for f in str(text).strip('\"').split(",") if f.strip() != ""]
+	if len(formats) == 0:
+		formats = ["text"]
+	if any(f not in RESULT_FORMATS for f in formats):
+		return None
+	return formats
+
+# Returns writer, or a writer that prints its text report when the block ends if writer is None.
+# Use in a with statement. Only a writer created here is closed at the end of the block.
+@contextlib.contextmanager
+def useWriter(writer = None):
+	if writer is not None:
+		yield writer
+		return
+	with ResultWriter([TextSink(sys.stdout)]) as writer:
+		yield writer
+
+# Appends text to a file in a single write. header is written first if the file is empty.
+def appendToFile(filepath, text, header = None):
+	with getFileLock(filepath):
+		with open(filepath, "a", newline = "") as f:
+			if header is not None and f.tell() == 0:
+				text = header + text
+			f.write(text)
+
+# Returns the lock for a file
+def getFileLock(filepath):
+	key = os.path.abspath(filepath)
+	with fileLocksLock:
+		if key not in fileLocks:
+			fileLocks[key] = threading.Lock()
+		return fileLocks[key]
+
+# Describes why a run stopped. The program prints its error message before it exits, so an exit only has its status.
+def describeError(error):
+	if isinstance(error, SystemExit):
+		return "the run stopped with exit status " + str(error.code) + " (see the printed error message)"
+	message = str(error).strip()
+	return type(error).__name__ + (" " + message if message != "" else "")
+
+# Converts NumPy values (and other values json cannot write) in a record to plain Python values
+def toJSON(value):
+	if isinstance(value, dict):
+		return {str(k): toJSON(v) for k, v in value.items()}
+	if isinstance(value, (list, tuple)):
+		return [toJSON(v) for v in value]
+	if hasattr(value, "tolist"):
+		return toJSON(value.tolist())
+	if value is None or isinstance(value, (str, int, float, bool)):
+		return value
+	return str(value)
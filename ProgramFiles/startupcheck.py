@@ -0,0 +1,68 @@
+'''
+startupcheck.py
+Checks that starting the program stays fast. Run from the ProgramFiles directory:
+
+	python3 startupcheck.py [--budget SECONDS]
+
+Uses "python -X importtime" to measure importing commandline.py. Fails if a heavy module that should only be
+loaded when needed (matplotlib, pandas, numba) is imported at startup, or if the import takes longer than the budget.
+'''
+
+# Imports #
+
+import sys
+import argparse
+import subprocess
+
+# Modules that must not be imported at startup
+LAZY_MODULES = ["matplotlib", "pandas", "numba"]
+
+# Check Functions #
+
+# Imports a module in a fresh interpreter with -X importtime
+# Returns a dictionary of module name to cumulative import time (in seconds)
+def measureImportTime(module = "commandline"):
+	process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+		capture_output = True, text = True)
+	if process.returncode != 0:
+		raise RuntimeError("Importing " + module + " failed:\n" + process.stderr)
+
+	times = {}
+	for line in process.stderr.splitlines():
+		if not line.startswith("import time:") or "|" not in line:
+			continue
+		parts = [p.strip() for p in line[len("import time:"):].split("|")]
+		if not parts[1].isdigit():
+			continue
+		times[parts[2]] = int(parts[1]) / 1e6
+	return times
+
+# Returns a list of problems found (empty if startup is fine)
+def checkStartup(budget = 1.5, module = "commandline"):
+	times = measureImportTime(module)
+	problems = []
+
+	loaded = sorted(name for name in times if name.split(".")[0] in LAZY_MODULES)
+	for name in loaded:
+		if "." not in name:
+			problems.append(name + " is imported at startup (" + str(round(times[name], 3)) + " s)")
+
+	total = times.get(module, 0)
+	if total > budget:
+		problems.append("importing " + module + " took " + str(round(total, 3)) + " s (budget " + str(budget) + " s)")
+
+	return total, problems
+
+
+# RUN MAIN #
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Check that importing commandline.py stays fast.")
+	parser.add_argument("--budget", type = float, default = 1.5, help = "largest allowed import time in seconds")
+	args = parser.parse_args()
+
+	total, problems = checkStartup(args.budget)
+	print("Import time of commandline:", round(total, 3), "s")
+	for p in problems:
+		print("FAIL:", p)
+	sys.exit(1 if problems else 0)
@@ -1,3 +1,3 @@
 #!/bin/sh
 cd ProgramFiles
-python3 commandline.py
\ No newline at end of file
+python3 commandline.py "$@"
\ No newline at end of file